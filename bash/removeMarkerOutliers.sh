@@ -12,4 +12,4 @@ source ~/anaconda3/etc/profile.d/conda.sh
 source /opt/ros/noetic/setup.bash
 conda activate gtg
 set -e
-python ${repoRoot}/src/removeMarkerPoseOutliers.py -p `echo ${savDr}`
\ No newline at end of file
+python ${repoRoot}/src/removeMarkerPoseOutliers.py -p `echo ${savDr}` "${@:2}"
\ No newline at end of file
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+import cv2 as cv
+import os
+import queue
+import threading
+import time
+
+
+class AsyncImageWriter:
+
+	# A bounded pool of background threads that encode and write images, so
+	# that the disk latency stays off the callback thread. When the queue is
+	# full, new images are dropped (or the caller waits, with 'block=True';
+	# 'block' of write() overrides it for one image).
+
+	def __init__(self, threadsNum=2, queueSize=64, jpegQuality=95,
+		pngCompression=3, block=False):
+
+		self._queue = queue.Queue(maxsize=queueSize)
+		self._block = block
+		self._jpegParams = [int(cv.IMWRITE_JPEG_QUALITY), int(jpegQuality)]
+		self._pngParams = [int(cv.IMWRITE_PNG_COMPRESSION), int(pngCompression)]
+		self._lock = threading.Lock()
+		self._startTime = time.time()
+		self.writtenNum = 0
+		self.droppedNum = 0
+		self.failedNum = 0
+		self.bytesNum = 0
+		self.maxDepth = 0
+
+		self._threads = []
+		for k in range(threadsNum):
+			th = threading.Thread(target=self.work, name="imageWriter{}".format(k))
+			th.daemon = True
+			th.start()
+			self._threads.append(th)
+
+
+	def write(self, fileName, image, copy=True, block=None):
+
+		# The image is copied unless the caller will not touch it anymore
+		if copy:
+			image = image.copy()
+
+		try:
+			self._queue.put((fileName, image),
+				block=self._block if block is None else block)
+		except queue.Full:
+			with self._lock:
+				self.droppedNum += 1
+			return False
+
+		depth = self._queue.qsize()
+		if depth > self.maxDepth:
+			self.maxDepth = depth
+		return True
+
+
+	def encodeParams(self, fileName):
+
+		ext = os.path.splitext(fileName)[1].lower()
+		if ext in ('.jpg', '.jpeg'):
+			return ext, self._jpegParams
+		elif ext == '.png':
+			return ext, self._pngParams
+		return ext, []
+
+
+	def work(self):
+
+		while True:
+			item = self._queue.get()
+			if item is None:
+				self._queue.task_done()
+				return
+
+			fileName, image = item
+			try:
+				ext, params = self.encodeParams(fileName)
+				ret, buf = cv.imencode(ext, image, params)
+				if not ret:
+					raise IOError("Could not encode " + fileName)
+				with open(fileName, 'wb') as f:
+					f.write(buf.tobytes())
+				with self._lock:
+					self.writtenNum += 1
+					self.bytesNum += len(buf)
+			except Exception as e:
+				print("Image writer failed on {}: {}".format(fileName, e))
+				with self._lock:
+					self.failedNum += 1
+			finally:
+				self._queue.task_done()
+
+
+	def stats(self):
+
+		elapsed = max(time.time() - self._startTime, 1e-9)
+		with self._lock:
+			return {'queueDepth': self._queue.qsize(), 'maxQueueDepth': self.maxDepth,
+				'written': self.writtenNum, 'dropped': self.droppedNum,
+				'failed': self.failedNum, 'bytes': self.bytesNum,
+				'bytesPerSec': self.bytesNum / elapsed}
+
+
+	def flush(self):
+		self._queue.join()
+
+
+	def close(self):
+
+		# Waits for every queued image to reach the disk, then stops the threads
+		self.flush()
+		for _ in self._threads:
+			self._queue.put(None)
+		for th in self._threads:
+			th.join()
+		self._threads = []
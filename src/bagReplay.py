@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+import cv2 as cv
+import numpy as np
+import pandas as pd
+import heapq
+import os
+from types import SimpleNamespace
+from imageDecoding import imgmsgToBgr
+
+try:
+	import rosbag
+except ImportError:
+	rosbag = None
+
+
+ODOM = 0
+IMAGE = 1
+
+ODOM_TOPIC = "/tello/odom"
+IMAGE_TOPIC = "/tello/camera/image_raw"
+
+
+class Stamp:
+
+	# Stand-in for rospy.Time, so that the recorded dump can be replayed
+	# without ROS installed
+
+	def __init__(self, secs, nsecs):
+		self.secs = int(secs)
+		self.nsecs = int(nsecs)
+
+	def to_sec(self):
+		return float(self.secs) + float(self.nsecs) / 1e9
+
+	def to_nsec(self):
+		return self.secs * 1000000000 + self.nsecs
+
+
+def makeOdomMsg(secs, nsecs, x, y, z, qx, qy, qz, qw):
+
+	position = SimpleNamespace(x=x, y=y, z=z)
+	orientation = SimpleNamespace(x=qx, y=qy, z=qz, w=qw)
+	return SimpleNamespace(header=SimpleNamespace(stamp=Stamp(secs, nsecs)),
+		pose=SimpleNamespace(pose=SimpleNamespace(position=position,
+			orientation=orientation)))
+
+
+def makeImageMsg(secs, nsecs, image):
+
+	image = np.ascontiguousarray(image)
+	return SimpleNamespace(header=SimpleNamespace(stamp=Stamp(secs, nsecs)),
+		height=image.shape[0], width=image.shape[1], encoding="bgr8",
+		is_bigendian=0, step=image.shape[1]*3, data=image.tobytes())
+
+
+def readTopic(bagFile, topic):
+
+	if rosbag is None:
+		raise ImportError("Reading a bag file requires the 'rosbag' package")
+
+	bag = rosbag.Bag(bagFile)
+	try:
+		for _, msg, _ in bag.read_messages(topics=[topic]):
+			yield msg
+	finally:
+		bag.close()
+
+
+def readBag(bagFile, odomTopic=ODOM_TOPIC, imageTopic=IMAGE_TOPIC):
+
+	return readTopic(bagFile, odomTopic), readTopic(bagFile, imageTopic)
+
+
+def readDump(dumpDir):
+
+	def odoms():
+		df = pd.read_csv(dumpDir + "/odom.csv", sep=',', header=None)
+		for row in df.itertuples(index=False):
+			yield makeOdomMsg(*row)
+
+	def images():
+		df = pd.read_csv(dumpDir + "/images.csv", sep=',', header=None)
+		for secs, nsecs, fileName in df.itertuples(index=False):
+			image = cv.imread(os.path.join(dumpDir, "images", fileName))
+			yield makeImageMsg(secs, nsecs, image)
+
+	return odoms(), images()
+
+
+def mergeStreams(odoms, images):
+
+	# Messages are replayed in header-stamp order instead of the order they
+	# arrived in, so that the result does not depend on the network delay of
+	# the live flight. For equal stamps odometry goes first, the way it would
+	# have been buffered before the image arrived. The (small) odometry
+	# messages are sorted by stamp up front, as the odometry buffer drops the
+	# out-of-order ones; the images are consumed lazily, so only one is held
+	# in memory, and keep their recorded order among themselves.
+	odomKeyed = sorted((m.header.stamp.to_nsec(), ODOM, k, m) for k, m in enumerate(odoms))
+	imageKeyed = ((m.header.stamp.to_nsec(), IMAGE, k, m) for k, m in enumerate(images))
+	for _, kind, _, msg in heapq.merge(odomKeyed, imageKeyed):
+		yield kind, msg
+
+
+def replay(messages, odomCallback, imageCallback):
+
+	odomNum = 0
+	imageNum = 0
+	for kind, msg in messages:
+		if kind == ODOM:
+			odomCallback(msg)
+			odomNum += 1
+		else:
+			imageCallback(msg)
+			imageNum += 1
+
+	return odomNum, imageNum
+
+
+def dumpBag(bagFile, dumpDir, odomTopic=ODOM_TOPIC, imageTopic=IMAGE_TOPIC):
+
+	# Requires rosbag; writes the plain message dump that 'readDump' replays
+
+	if not os.path.exists(dumpDir + "/images"):
+		os.makedirs(dumpDir + "/images")
+
+	odoms = []
+	for msg in readTopic(bagFile, odomTopic):
+		stamp = msg.header.stamp
+		p = msg.pose.pose.position
+		q = msg.pose.pose.orientation
+		odoms.append([stamp.secs, stamp.nsecs, p.x, p.y, p.z, q.x, q.y, q.z, q.w])
+
+	images = []
+	for msg in readTopic(bagFile, imageTopic):
+		stamp = msg.header.stamp
+		fileName = "{}_{:09d}.png".format(stamp.secs, stamp.nsecs)
+		cv.imwrite(dumpDir + "/images/" + fileName, imgmsgToBgr(msg))
+		images.append([stamp.secs, stamp.nsecs, fileName])
+
+	pd.DataFrame(odoms).to_csv(dumpDir + "/odom.csv", index=False, header=False,
+		float_format="%.17g")
+	pd.DataFrame(images).to_csv(dumpDir + "/images.csv", index=False, header=False)
+
+
+if __name__ == '__main__' :
+
+	import argparse
+	parser = argparse.ArgumentParser()
+	parser.add_argument('-b', '--bag', help='The Path to the Bag File.', dest='bag')
+	parser.add_argument('-o', '--out', help='The Directory to Write the Message Dump.',
+		dest='out')
+	args, unknown = parser.parse_known_args()
+
+	dumpBag(args.bag, args.out)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+# Compares the speed and accuracy of the downscaled (pyramid) marker detection
+# with the full resolution one, on the frames saved in <save-dir>/rawImage.
+#
+# python3 benchmarkMarkerDetection.py -p <save-dir> --scales 0.75 0.5
+
+import cv2 as cv
+import numpy as np
+import pandas as pd
+import os
+import time
+
+from telloGTGeneration import ArucoBasedDroneGroundTruthGeneration
+from markerDetector import ArucoDetector
+import testData
+
+import argparse
+parser = argparse.ArgumentParser()
+parser.add_argument('-p', '--path', help='The Path to the Save Directory.', dest='path')
+parser.add_argument('--scales', help='The detection scales to compare with 1.0.',
+	dest='scales', type=float, nargs='+', default=[0.75, 0.5])
+parser.add_argument('--limit', help='Use only this number of frames (evenly spread).',
+	dest='limit', type=int)
+benchArgs, unknown = parser.parse_known_args()
+
+
+def listFrames(path, limit=None):
+
+	frameDir = path + "/rawImage"
+	names = sorted(os.listdir(frameDir), key=lambda n: float(os.path.splitext(n)[0]))
+	if not limit is None and limit < len(names):
+		names = [names[k] for k in np.linspace(0, len(names)-1, limit).astype(int)]
+	return [os.path.join(frameDir, n) for n in names]
+
+
+def detectAll(detector, frames):
+
+	results = []
+	elapsed = 0
+	for img in frames:
+		t0 = time.perf_counter()
+		corners, ids, _ = detector.detect(img)
+		elapsed += time.perf_counter() - t0
+		found = {}
+		if not ids is None:
+			for c, i in zip(corners, ids.flatten()):
+				if int(i) in testData.idPoses.keys():
+					found[int(i)] = c.reshape(4, 2)
+		results.append(found)
+	return results, elapsed
+
+
+def markerTvec(corners, agtg):
+
+	ret = cv.aruco.estimatePoseSingleMarkers(corners.reshape(1, 4, 2),
+		agtg._markerLength, agtg._cameraMatrix, agtg._distortionMatrix)
+	return ret[1][0, 0, :]
+
+
+def compare(reference, results, agtg):
+
+	refNum = 0
+	foundNum = 0
+	extraNum = 0
+	cornerErrors = []
+	tvecErrors = []
+	for ref, res in zip(reference, results):
+		refNum += len(ref)
+		extraNum += len([i for i in res if not i in ref])
+		for i, c in ref.items():
+			if not i in res:
+				continue
+			foundNum += 1
+			cornerErrors.append(np.linalg.norm(res[i] - c, axis=1).mean())
+			tvecErrors.append(np.linalg.norm(markerTvec(res[i], agtg) - \
+				markerTvec(c, agtg)))
+
+	def stat(v, f):
+		return f(v) if len(v) > 0 else np.nan
+
+	return {'recall': foundNum / max(refNum, 1), 'extraDetections': extraNum,
+		'meanCornerErrorPx': stat(cornerErrors, np.mean),
+		'maxCornerErrorPx': stat(cornerErrors, np.max),
+		'meanTvecErrorM': stat(tvecErrors, np.mean),
+		'maxTvecErrorM': stat(tvecErrors, np.max)}
+
+
+if __name__ == '__main__' :
+
+	agtg = ArucoBasedDroneGroundTruthGeneration(benchArgs.path, outlierRemovalMode=True)
+	fileNames = listFrames(benchArgs.path, benchArgs.limit)
+	print("Loading {} frames".format(len(fileNames)))
+	frames = [cv.imread(f) for f in fileNames]
+
+	validIds = set(testData.idPoses.keys())
+	reference, refElapsed = detectAll(ArucoDetector(agtg._arucoDict,
+		agtg._arucoParams, validIds), frames)
+
+	rows = [dict({'scale': 1.0, 'msPerFrame': 1000 * refElapsed / len(frames),
+		'speedup': 1.0}, **compare(reference, reference, agtg))]
+	for scale in benchArgs.scales:
+		results, elapsed = detectAll(ArucoDetector(agtg._arucoDict, agtg._arucoParams,
+			validIds, scale=scale), frames)
+		rows.append(dict({'scale': scale, 'msPerFrame': 1000 * elapsed / len(frames),
+			'speedup': refElapsed / max(elapsed, 1e-12)},
+			**compare(reference, results, agtg)))
+
+	df = pd.DataFrame(rows)
+	print(df.to_string(index=False))
+	df.to_csv(benchArgs.path + "/markerDetectionBenchmark.csv", index=False)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+import numpy as np
+import hashlib
+import os
+from collections import OrderedDict
+
+
+# Rough file system cost of each entry, counted along with its payload
+ENTRY_OVERHEAD = 64
+
+
+def paramsKey(*values):
+
+	# Hashes the detector settings; the cv.aruco.DetectorParameters objects are
+	# expanded into their numeric fields
+	h = hashlib.blake2b(digest_size=16)
+	for v in values:
+		if hasattr(v, 'adaptiveThreshWinSizeMin'):
+			fields = sorted([n for n in dir(v) if not n.startswith('_')])
+			v = [(n, getattr(v, n)) for n in fields
+				if isinstance(getattr(v, n), (int, float, bool))]
+		h.update(repr(v).encode())
+	return h.hexdigest()
+
+
+class DetectionCache:
+
+	# Marker detections stored on the disk, keyed by the hash of the frame
+	# content and of the detector settings. Each entry only holds the marker
+	# IDs (int32) and corners (float32), which is 36 bytes per marker, so the
+	# pose can be recomputed from the cached corners with another calibration
+	# or marker length. The least recently used entries are removed when the
+	# cache grows over 'maxBytes'.
+
+	def __init__(self, cacheDir, settingsKey, maxBytes=100*1024*1024):
+
+		self._cacheDir = cacheDir
+		self._settingsKey = settingsKey
+		self._maxBytes = maxBytes
+		self._entries = OrderedDict()
+		self._bytes = 0
+		self.hitsNum = 0
+		self.missesNum = 0
+		self.evictionsNum = 0
+
+		if not os.path.exists(cacheDir):
+			os.makedirs(cacheDir)
+
+		# Oldest first, as the access time is kept in the file mtime
+		files = []
+		for name in os.listdir(cacheDir):
+			st = os.stat(os.path.join(cacheDir, name))
+			files.append((st.st_mtime, name, st.st_size))
+		for _, name, size in sorted(files):
+			self._entries[name] = size + ENTRY_OVERHEAD
+			self._bytes += size + ENTRY_OVERHEAD
+
+
+	def key(self, img):
+
+		h = hashlib.blake2b(digest_size=20)
+		h.update(self._settingsKey.encode())
+		h.update(repr((img.shape, img.dtype.str)).encode())
+		h.update(np.ascontiguousarray(img).data)
+		return h.hexdigest()
+
+
+	def get(self, key):
+
+		# Returns (corners, ids) like cv.aruco.detectMarkers, or None on a miss
+		fileName = os.path.join(self._cacheDir, key)
+		if not key in self._entries:
+			self.missesNum += 1
+			return None
+
+		try:
+			with open(fileName, 'rb') as f:
+				buf = f.read()
+			os.utime(fileName)
+		except FileNotFoundError:
+			# Removed by another process sharing the cache
+			self._bytes -= self._entries.pop(key)
+			self.missesNum += 1
+			return None
+
+		self._entries.move_to_end(key)
+		self.hitsNum += 1
+		n = len(buf) // 36
+		if n == 0:
+			return (), None
+		ids = np.frombuffer(buf, dtype='<i4', count=n).astype(np.int32).reshape(n, 1)
+		corners = np.frombuffer(buf, dtype='<f4', offset=4*n).astype(np.float32)
+		corners = corners.reshape(n, 1, 4, 2)
+		return tuple([c for c in corners]), ids
+
+
+	def put(self, key, corners, ids):
+
+		if ids is None or len(ids) == 0:
+			buf = b''
+		else:
+			buf = np.asarray(ids, dtype='<i4').reshape(-1).tobytes() + \
+				np.asarray(corners, dtype='<f4').reshape(-1).tobytes()
+
+		with open(os.path.join(self._cacheDir, key), 'wb') as f:
+			f.write(buf)
+
+		if key in self._entries:
+			self._bytes -= self._entries.pop(key)
+		self._entries[key] = len(buf) + ENTRY_OVERHEAD
+		self._bytes += len(buf) + ENTRY_OVERHEAD
+
+		while self._bytes > self._maxBytes and len(self._entries) > 1:
+			oldKey, size = self._entries.popitem(last=False)
+			self._bytes -= size
+			self.evictionsNum += 1
+			try:
+				os.remove(os.path.join(self._cacheDir, oldKey))
+			except FileNotFoundError:
+				pass
+
+
+	def stats(self):
+
+		return {'hits': self.hitsNum, 'misses': self.missesNum,
+			'evictions': self.evictionsNum, 'entries': len(self._entries),
+			'bytes': self._bytes}
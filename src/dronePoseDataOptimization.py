@@ -3,14 +3,206 @@
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
+import yaml
+import os
+import multiprocessing
 
 
 import argparse
 parser = argparse.ArgumentParser()
 parser.add_argument('-p', '--path', help='The Path to the Bag File.', dest='path')
+parser.add_argument('-m', '--mode', help='\'solve\': fit the drift model in closed form '
+    'and save it to <path>/driftModel.yaml, \'descent\': fit it by gradient descent, '
+    '\'robust\': also fit the yaw and the clock offset with a robust loss, '
+    '\'correct\': correct and plot the odometry with the saved model, \'apply\': '
+    'correct the odometry chunk by chunk, without plotting, \'uncertainty\': '
+    'bootstrap and cross-validate the least-squares fit.', dest='mode',
+    choices=['solve', 'robust', 'descent', 'correct', 'apply', 'uncertainty'],
+    default='correct')
+parser.add_argument('-w', '--weights', help='Weight the marker poses by the confidence '
+    'in <path>/markerPoseScores.csv (scoreMarkerPoses.py).', dest='weights',
+    choices=['none', 'confidence'], default='none')
+parser.add_argument('-i', '--interp', help='How the odometry is sampled at the marker '
+    'pose times.', dest='interp', choices=['nearest', 'linear', 'spline'],
+    default='nearest')
+parser.add_argument('--loss', help='Robust loss of the \'robust\' mode.', dest='loss',
+    choices=['huber', 'cauchy', 'none'], default='huber')
+parser.add_argument('--loss-scale', help='Marker pose error (meters) beyond which the '
+    'robust loss takes over.', dest='lossScale', type=float, default=0.1)
+parser.add_argument('--max-iter', help='Iterations of the \'robust\' mode.',
+    dest='maxIter', type=int, default=50)
+parser.add_argument('--chunk-rows', help='Odometry rows read at once by the \'apply\' '
+    'mode.', dest='chunkRows', type=int, default=100000)
+parser.add_argument('--resamples', help='Bootstrap resamples of the \'uncertainty\' mode.',
+    dest='resamples', type=int, default=500)
+parser.add_argument('--folds', help='Cross-validation folds of the \'uncertainty\' mode.',
+    dest='folds', type=int, default=5)
+parser.add_argument('--ci', help='Confidence level (percent) of the parameter intervals.',
+    dest='ci', type=float, default=95)
+parser.add_argument('--workers', help='Number of worker processes (defaults to the '
+    'number of cores).', dest='workers', type=int)
+parser.add_argument('--seed', help='Seed of the resampling.', dest='seed', type=int,
+    default=0)
 args, unknown = parser.parse_known_args()
 
 
+PARAM_NAMES = ['scale', 'driftX', 'driftY', 'driftZ', 'offsetX', 'offsetY', 'offsetZ']
+ROBUST_PARAM_NAMES = ['scale', 'yaw', 'timeOffset', 'driftX', 'driftY', 'driftZ',
+    'offsetX', 'offsetY', 'offsetZ']
+
+
+def yawDcm(yaw):
+
+    # The rotation about z and its derivative by the yaw angle
+    c, s = np.cos(yaw), np.sin(yaw)
+    R = np.array([[c, -s, 0], [s, c, 0], [0, 0, 1.0]])
+    dR = np.array([[-s, -c, 0], [c, -s, 0], [0, 0, 0.0]])
+    return R, dR
+
+
+def robustWeights(norms, loss, scale):
+
+    # IRLS weights and the loss values of the residual norms
+    if loss == 'huber':
+        w = np.where(norms <= scale, 1.0, scale / np.maximum(norms, 1e-12))
+        rho = np.where(norms <= scale, 0.5 * norms**2, scale * (norms - 0.5 * scale))
+    elif loss == 'cauchy':
+        w = 1.0 / (1.0 + (norms / scale)**2)
+        rho = 0.5 * scale**2 * np.log1p((norms / scale)**2)
+    else:
+        w = np.ones(len(norms))
+        rho = 0.5 * norms**2
+    return w, rho
+
+
+def readModel(fileName):
+
+    # The linear parameters (PARAM_NAMES order), the yaw, the time offset and
+    # the odometry sampling method of the fit (None if not saved)
+    with open(fileName) as f:
+        model = yaml.safe_load(f)
+    params = np.array([model['params'][n] for n in PARAM_NAMES], dtype=float)
+    return params, float(model['params'].get('yaw', 0.0)), \
+        float(model['params'].get('timeOffset', 0.0)), model.get('interp')
+
+
+def samplingMethod(interp, timeOffset, requested):
+
+    # A fitted time offset is a sub-sample quantity: the odometry is sampled
+    # the way it was in the fit (linear for the models saved before the
+    # method was), instead of being rounded to the samples by 'nearest'
+    if timeOffset == 0:
+        return requested
+    if interp is None:
+        return 'linear' if requested == 'nearest' else requested
+    return interp
+
+
+def applyModelStream(path, chunkRows=100000, method='nearest'):
+
+    # Writes <path>/correctedPose.csv like 'visualize' does, reading the
+    # (time ordered) odometry in chunks of 'chunkRows' rows. Only the odometry
+    # samples around the times still to be corrected are kept, so the memory
+    # does not grow with the flight. The spline is fitted on these samples
+    # only, which is close to, but not the same as, the whole flight spline.
+    # A model with a time offset keeps the sampling method of its fit.
+    params, yaw, timeOffset, interp = readModel(path + "/driftModel.yaml")
+    method = samplingMethod(interp, timeOffset, method)
+    R = yawDcm(yaw)[0]
+    margin = 3 if method == 'spline' else 1
+
+    t0 = None
+    winT = np.zeros(0)
+    winXyz = np.zeros((0, 3))
+    pending = np.zeros(0)
+    written = 0
+
+    def flush(f, final):
+
+        nonlocal winT, winXyz, pending, written
+        if len(pending) == 0:
+            return
+        # The times whose odometry neighbours are all read
+        n = len(pending) if final else \
+            int(np.searchsorted(pending + timeOffset, winT[-1], side='right'))
+        if n > 0:
+            t = pending[:n]
+            window = PoseData(xs=winXyz[:,0].reshape(1,-1), ys=winXyz[:,1].reshape(1,-1),
+                zs=winXyz[:,2].reshape(1,-1), ts=winT)
+            odoms = window.get_many(t + timeOffset, method)
+            corrected = params[0]*odoms.dot(R.T) + np.outer(t, params[1:4]) + params[4:7]
+            df = pd.DataFrame({'x': corrected[:,0], 'y': corrected[:,1],
+                'z': corrected[:,2], 't': t}, index=range(written, written + n))
+            df.to_csv(f, header=written == 0)
+            written += n
+            pending = pending[n:]
+
+        nextT = pending[0] if len(pending) else winT[-1]
+        lo = int(np.searchsorted(winT, nextT + timeOffset)) - margin
+        lo = min(max(lo, 0), len(winT) - 1)
+        winT = winT[lo:]
+        winXyz = winXyz[lo:]
+
+    fileName = path + '/correctedPose.csv'
+    with open(fileName, 'w') as f:
+        for chunk in pd.read_csv(path + "/zodomPoses.csv", sep=',', header=None,
+            usecols=[0, 1, 2, 3], chunksize=chunkRows):
+            values = chunk.values.astype(float)
+            if t0 is None:
+                t0 = values[0, 3]
+            ts = values[:, 3] - t0
+            winT = np.concatenate((winT, ts))
+            winXyz = np.concatenate((winXyz, values[:, :3]))
+            pending = np.concatenate((pending, ts))
+            flush(f, False)
+        flush(f, True)
+
+    print("{} corrected poses written to {}".format(written, fileName))
+    return written
+
+
+# The design matrix (N,3,7), marker poses (N,3) and weights (N,) shared with
+# the resampling workers
+_fitData = None
+
+
+def initFitWorker(A, b, w):
+
+    global _fitData
+    _fitData = (A, b, w)
+
+
+def fitSamples(idx):
+
+    # Weighted least-squares parameters on the marker poses 'idx'
+    A, b, w = _fitData
+    sw = np.sqrt(np.repeat(w[idx], 3)).reshape(-1,1)
+    return np.linalg.lstsq(A[idx].reshape(-1, A.shape[2]) * sw,
+        b[idx].reshape(-1,1) * sw, rcond=None)[0].ravel()
+
+
+def foldErrors(job):
+
+    # Parameters fitted without the fold and their errors on the fold
+    train, test = job
+    A, b, w = _fitData
+    params = fitSamples(train)
+    norms = np.linalg.norm(b[test] - A[test].dot(params), axis=1)
+    return params, float(np.sqrt(np.mean(norms**2))), float(np.median(norms)), len(test)
+
+
+def residualStats(residuals, w, dof, sigma2):
+
+    norms = np.linalg.norm(residuals, axis=1)
+    return {'samples': int(len(norms)), 'dof': int(dof),
+        'cost': float(np.sum(residuals**2)),
+        'weightedCost': float(np.sum(w.reshape(-1,1) * residuals**2)),
+        'sigma': float(np.sqrt(sigma2)),
+        'rms': float(np.sqrt(np.mean(norms**2))),
+        'rmsXYZ': np.sqrt(np.mean(residuals**2, axis=0)).tolist(),
+        'median': float(np.median(norms)), 'max': float(np.max(norms))}
+
+
 class PoseData:
 
     def __init__(self, dataFrame = None, xs = None, ys = None, zs = None, ts = None):
@@ -27,19 +219,97 @@ class PoseData:
             self.z = zs[0]
             self.t = ts
 
+        # Time index: the samples sorted by time (stable, so that equal times
+        # keep the file order)
+        order = np.argsort(np.asarray(self.t, dtype=float), kind='stable')
+        self._ts = np.asarray(self.t, dtype=float)[order]
+        self._xyz = np.stack((self.x, self.y, self.z), axis=1).astype(float)[order]
+        self._spline = None
+
 
     def get(self, time):
-        # TODO: There must be easier ways to get "x,y,z" by passing "t". Try
-        # building a dict member which simply gets "t" and returns "x,y,z"
-        minDiff = 1e14
-        idx = None
-        for k in range(np.shape(self.t)[0]):
-            diff = abs(self.t[k]-time)
-            if diff < minDiff:
-                minDiff = diff
-                idx = k
 
-        return np.array([self.x[idx], self.y[idx], self.z[idx]]).reshape(3,1)
+        return self.get_many([time]).reshape(3,1)
+
+
+    def get_many(self, times, method='nearest', outOfRange='clamp'):
+
+        # The (N,3) positions at 'times', by the nearest sample, linear
+        # interpolation or a cubic spline. Out of the logged time span, the
+        # positions are clamped to the end samples ('clamp'), extrapolated
+        # ('extrapolate'; the nearest method clamps), set to NaN ('nan') or
+        # refused ('raise').
+        if not method in ('nearest', 'linear', 'spline'):
+            raise ValueError("Unknown interpolation method: " + str(method))
+        times = np.asarray(times, dtype=float).reshape(-1)
+        ts = self._ts
+        outside = (times < ts[0]) | (times > ts[-1])
+        if outOfRange == 'raise' and np.any(outside):
+            raise ValueError("{} times out of the range [{}, {}]".format(
+                np.count_nonzero(outside), ts[0], ts[-1]))
+
+        if len(ts) == 1:
+            out = np.repeat(self._xyz, len(times), axis=0)
+
+        elif method == 'nearest':
+            k = np.clip(np.searchsorted(ts, times), 1, len(ts) - 1)
+            # Ties go to the earlier sample
+            k = np.where(times - ts[k-1] <= ts[k] - times, k - 1, k)
+            out = self._xyz[k]
+
+        elif method == 'linear':
+            k = np.clip(np.searchsorted(ts, times, side='right'), 1, len(ts) - 1)
+            dt = ts[k] - ts[k-1]
+            ratio = np.divide(times - ts[k-1], dt, out=np.zeros(len(times)),
+                where=dt > 0)
+            if outOfRange != 'extrapolate':
+                ratio = np.clip(ratio, 0, 1)
+            out = self._xyz[k-1] + ratio.reshape(-1,1) * (self._xyz[k] - self._xyz[k-1])
+
+        elif method == 'spline':
+            if outOfRange == 'extrapolate':
+                out = self.spline()(times)
+            else:
+                out = self.spline()(np.clip(times, ts[0], ts[-1]))
+
+        if outOfRange == 'nan':
+            out = np.array(out, dtype=float)
+            out[outside] = np.nan
+        return out
+
+
+    def spline(self):
+
+        if self._spline is None:
+            # scipy is only needed for this method
+            from scipy.interpolate import CubicSpline
+            # The spline needs strictly increasing times
+            keep = np.concatenate(([True], np.diff(self._ts) > 0))
+            self._spline = CubicSpline(self._ts[keep], self._xyz[keep], axis=0)
+        return self._spline
+
+
+    def velocity_many(self, times, method='linear'):
+
+        # The (N,3) time derivative of 'get_many' (clamped out of range, where
+        # it is zero); the nearest sample method has none
+        times = np.asarray(times, dtype=float).reshape(-1)
+        ts = self._ts
+        out = np.zeros((len(times), 3))
+        if len(ts) < 2 or method == 'nearest':
+            return out
+
+        inside = (times >= ts[0]) & (times <= ts[-1])
+        if method == 'spline':
+            out[inside] = self.spline().derivative()(times[inside])
+            return out
+
+        k = np.clip(np.searchsorted(ts, times, side='right'), 1, len(ts) - 1)
+        dt = ts[k] - ts[k-1]
+        slope = np.divide(self._xyz[k] - self._xyz[k-1], dt.reshape(-1,1),
+            out=np.zeros((len(times), 3)), where=dt.reshape(-1,1) > 0)
+        out[inside] = slope[inside]
+        return out
 
 
 
@@ -50,31 +320,35 @@ class OptimizeDronePoseData:
         actualData = path + "/zodomPoses.csv" 
         trueData = path + "/cleanMarkerPoses.csv"
 
+        trueDataFrame = pd.read_csv(trueData, sep=',', header=None)
         self.actualData = PoseData(dataFrame = \
             pd.read_csv(actualData, sep=',', header=None))
-        self.trueData = PoseData(dataFrame = \
-            pd.read_csv(trueData, sep=',', header=None))
-
-        # params0 = [1.1, 0.08, 0.07, 0.07, 0.001, 0.001, 0.001]
-        # params0 = [0.87904138, -0.03340808, -0.01419431, 0.00430938, -0.02820221, 0.02055454, 0.00184789]
-        params0 = [0.87895081, -0.02968645, -0.01686102,  0.00426654, -0.02887164,  0.02091124, 0.00197401]
-        # params0 = [ 0.80533649 -0.02953783  0.00194023 -0.12916038 -0.02395732  0.01647432  -0.00354204]
+        self.trueData = PoseData(dataFrame = trueDataFrame)
+        self.trueTimes = np.array(trueDataFrame.values[:,3], dtype=float)
 
-        self.paramsNum = len(params0)
-        self.params = np.array(params0).reshape(self.paramsNum,1)
+        self.path = path
+        self.modelFileName = path + "/driftModel.yaml"
+
+        # The identity model until one is fitted or loaded. The yaw and the
+        # time offset are only fitted by the robust mode.
+        self.paramsNum = len(PARAM_NAMES)
+        self.params = np.array([1.0, 0, 0, 0, 0, 0, 0]).reshape(self.paramsNum,1)
+        self.yaw = 0.0
+        self.timeOffset = 0.0
+        # How the odometry is sampled at the marker pose times
+        self.interp = args.interp
+        # Only used by the gradient descent
         self.dp = 1e-4
         self.delta = 1e-7
         self.convergencRadius = 1e-7
         self.allowedSteps = 1000
 
-        fig = plt.figure()
-        self.ax = fig.add_subplot(111, projection='3d')
-        self.path = path
-
 
     def visualize(self):
 
         self.calcAllNewData()
+        fig = plt.figure()
+        self.ax = fig.add_subplot(111, projection='3d')
         self.ax.cla()
         self.ax.plot(self.actualData.x, self.actualData.y, self.actualData.z,
             color='blue', linewidth=2)
@@ -127,48 +401,41 @@ class OptimizeDronePoseData:
 
     def calcAllNewData(self):
 
-        xs = []
-        ys = []
-        zs = []
-        for k in range(np.shape(self.actualData.t)[0]):
-            t = self.actualData.t[k]
-            newData = self.params[0]*self.actualData.get(t) + \
-                self.params[1:4]*t + self.params[4:7]
+        t = np.asarray(self.actualData.t, dtype=float)
+        newData = self.calcCorrectedData(t, self.params)
 
-            xs.append(newData[0])
-            ys.append(newData[1])
-            zs.append(newData[2])
-
-        self.correctedData = PoseData(xs = np.transpose(np.array(xs)),
-            ys = np.transpose(np.array(ys)), zs = np.transpose(np.array(zs)),
+        self.correctedData = PoseData(xs = newData[:,0].reshape(1,-1),
+            ys = newData[:,1].reshape(1,-1), zs = newData[:,2].reshape(1,-1),
             ts = self.actualData.t)
         print("done")
 
 
-    def calcPointCorrectedData(self, t, addIdx):
+    def calcCorrectedData(self, t, params):
 
-        params = []
-        for k in range(self.paramsNum):
-            if addIdx == k:
-                p = self.params[k] + self.dp
-            else:
-                p = self.params[k]
-            params.append(p)
+        # The (N,3) corrected odometry positions at the times 't'
+        params = np.asarray(params, dtype=float).ravel()
+        odoms = self.actualData.get_many(t + self.timeOffset, self.interp)
+        if self.yaw != 0:
+            odoms = odoms.dot(yawDcm(self.yaw)[0].T)
+        return params[0]*odoms + np.outer(t, params[1:4]) + params[4:7]
 
-        params = np.array(params).reshape(self.paramsNum,1)
-        return params[0]*self.actualData.get(t) + params[1:4]*t + params[4:7]
 
+    def calcPointCorrectedData(self, t, addIdx):
 
-    def costFunc(self, addIdx = 10):
+        params = self.params.astype(float).ravel().copy()
+        if addIdx < self.paramsNum:
+            params[addIdx] += self.dp
+        return self.calcCorrectedData(np.array([t], dtype=float), params).reshape(3,1)
 
-        J = 0
-        for k in range(np.shape(self.trueData.t)[0]):
-            t = self.trueData.t[k]
-            currentTrueData = self.trueData.get(t)
-            J += np.linalg.norm(currentTrueData - self.calcPointCorrectedData(t,
-                addIdx))**2
 
-        return J
+    def costFunc(self, addIdx = 10):
+
+        params = self.params.astype(float).ravel().copy()
+        if addIdx < self.paramsNum:
+            params[addIdx] += self.dp
+        t = np.asarray(self.trueData.t, dtype=float)
+        currentTrueData = self.trueData.get_many(t)
+        return float(np.sum((currentTrueData - self.calcCorrectedData(t, params))**2))
 
 
     def costFuncGradient(self):
@@ -202,9 +469,279 @@ class OptimizeDronePoseData:
         return ret
 
 
+    def markerWeights(self):
+
+        # The confidences of the marker poses, matched by their logged time;
+        # poses without a score get the weight 1
+        weights = np.ones(len(self.trueTimes))
+        scores = pd.read_csv(self.path + "/markerPoseScores.csv")
+        conf = dict(zip(scores['Time'].values, scores['Confidence'].values))
+        for k, t in enumerate(self.trueTimes):
+            weights[k] = conf.get(t, 1.0)
+        return weights
+
+
+    def designMatrix(self):
+
+        # The model p0*odom + p[1:4]*t + p[4:7] is linear in the parameters:
+        # for axis i of a marker pose at time t, the row is
+        # [odom_i, t*e_i, e_i]. The rows of a pose are stacked axis by axis.
+        # A loaded yaw and time offset are applied to the odometry.
+        t = np.asarray(self.trueData.t, dtype=float)
+        odoms = self.actualData.get_many(t + self.timeOffset, self.interp)
+        if self.yaw != 0:
+            odoms = odoms.dot(yawDcm(self.yaw)[0].T)
+        n = len(t)
+        A = np.zeros((n, 3, self.paramsNum))
+        A[:, :, 0] = odoms
+        eye = np.eye(3)
+        A[:, :, 1:4] = t.reshape(n,1,1) * eye
+        A[:, :, 4:7] = eye
+        b = np.stack((self.trueData.x, self.trueData.y, self.trueData.z),
+            axis=1).astype(float)
+        return A.reshape(3*n, self.paramsNum), b.reshape(3*n)
+
+
+    def leastSquaresOptimize(self, weights=None):
+
+        # Minimizes the same cost as 'costFunc' (weighted per marker pose) in
+        # one linear solve, and returns the parameters' covariance and the
+        # residual statistics along with them
+        A, b = self.designMatrix()
+        n = len(b) // 3
+        w = np.ones(n) if weights is None else np.asarray(weights, dtype=float)
+        sw = np.sqrt(np.repeat(w, 3))
+
+        params, _, rank, _ = np.linalg.lstsq(A * sw.reshape(-1,1), b * sw, rcond=None)
+        if rank < self.paramsNum:
+            print("Warning: the drift model is not fully determined by the data")
+        self.params = params.reshape(self.paramsNum,1)
+        return self.fitStats(weights, A, b)
+
+
+    def fitStats(self, weights=None, A=None, b=None):
+
+        # Covariance and residual statistics of the current parameters (of the
+        # least-squares fit or the gradient descent), for the linear model at
+        # the fixed yaw and time offset; 'A, b' is the design matrix if built
+        if A is None:
+            A, b = self.designMatrix()
+        n = len(b) // 3
+        w = np.ones(n) if weights is None else np.asarray(weights, dtype=float)
+        sw = np.sqrt(np.repeat(w, 3))
+        residuals = (b - A.dot(self.params.astype(float).ravel())).reshape(n,3)
+        dof = max(3*n - self.paramsNum, 1)
+        sigma2 = np.sum(w.reshape(n,1) * residuals**2) / dof
+        cov = sigma2 * np.linalg.pinv((A * sw.reshape(-1,1)).T.dot(
+            A * sw.reshape(-1,1)))
+        return cov, residualStats(residuals, w, dof, sigma2)
+
+
+    def robustResiduals(self, x, t, markers, method):
+
+        # Residuals of the model
+        #   scale * Rz(yaw) * odom(t + timeOffset) + drift*t + offset
+        # for x = [scale, yaw, timeOffset, drift, offset], and their analytic
+        # Jacobian by x, as (N,3) and (N,3,9)
+        odoms = self.actualData.get_many(t + x[2], method)
+        velocities = self.actualData.velocity_many(t + x[2], method)
+        R, dR = yawDcm(x[1])
+        rotated = odoms.dot(R.T)
+
+        J = np.zeros((len(t), 3, 9))
+        J[:, :, 0] = rotated
+        J[:, :, 1] = x[0] * odoms.dot(dR.T)
+        J[:, :, 2] = x[0] * velocities.dot(R.T)
+        J[:, :, 3:6] = t.reshape(-1,1,1) * np.eye(3)
+        J[:, :, 6:9] = np.eye(3)
+        residuals = markers - (x[0] * rotated + np.outer(t, x[3:6]) + x[6:9])
+        return residuals, J
+
+
+    def robustOptimize(self, weights=None, loss='huber', lossScale=0.1, maxIter=50):
+
+        # Levenberg-Marquardt on the IRLS weighted normal equations, started
+        # from the linear least-squares fit. The clock offset needs the
+        # odometry interpolated, so the nearest sample method is replaced by
+        # the linear one.
+        method = 'linear' if args.interp == 'nearest' else args.interp
+        t = np.asarray(self.trueData.t, dtype=float)
+        markers = self.trueData.get_many(t)
+        w0 = np.ones(len(t)) if weights is None else np.asarray(weights, dtype=float)
+
+        self.yaw = 0.0
+        self.timeOffset = 0.0
+        self.interp = args.interp
+        self.leastSquaresOptimize(weights)
+        p = self.params.ravel()
+        x = np.concatenate((p[:1], [0.0, 0.0], p[1:]))
+
+        def cost(residuals):
+            w, rho = robustWeights(np.linalg.norm(residuals, axis=1), loss, lossScale)
+            return np.sum(w0 * rho), w * w0
+
+        residuals, J = self.robustResiduals(x, t, markers, method)
+        J0, wr = cost(residuals)
+        lam = 1e-3
+        converged = False
+        it = 0
+        for it in range(1, maxIter + 1):
+            H = np.einsum('nai,n,naj->ij', J, wr, J)
+            g = np.einsum('nai,n,na->i', J, wr, residuals)
+            step = np.linalg.solve(H + lam * np.diag(np.diag(H) + 1e-12), g)
+            newResiduals, newJ = self.robustResiduals(x + step, t, markers, method)
+            newCost, newWr = cost(newResiduals)
+            print("iteration {}: cost {:.6g}, lambda {:.1e}".format(it, newCost, lam))
+
+            if newCost < J0:
+                x = x + step
+                residuals, J, wr = newResiduals, newJ, newWr
+                decrease = J0 - newCost
+                J0 = newCost
+                lam = max(lam / 10, 1e-12)
+                if decrease <= 1e-10 * max(J0, 1e-12) or \
+                    np.linalg.norm(step) <= 1e-10 * (np.linalg.norm(x) + 1e-10):
+                    converged = True
+                    break
+            else:
+                lam *= 10
+                if lam > 1e10:
+                    converged = True
+                    break
+
+        self.params = np.concatenate((x[:1], x[3:])).reshape(self.paramsNum,1)
+        self.yaw = float(x[1])
+        self.timeOffset = float(x[2])
+        self.interp = method
+
+        H = np.einsum('nai,n,naj->ij', J, wr, J)
+        dof = max(3*len(t) - 9, 1)
+        sigma2 = np.sum(wr.reshape(-1,1) * residuals**2) / dof
+        cov = sigma2 * np.linalg.pinv(H)
+        stats = residualStats(residuals, wr, dof, sigma2)
+        stats.update({'loss': loss, 'lossScale': float(lossScale),
+            'iterations': int(it), 'converged': bool(converged)})
+        return cov, stats
+
+
+    def resampleUncertainty(self, weights=None, resamples=500, folds=5, ci=95,
+        workers=None, seed=0):
+
+        # Bootstrap (marker poses drawn with replacement) and K-fold
+        # cross-validation of the least-squares fit, run in a process pool.
+        # Writes the per-parameter intervals to <path>/driftUncertainty.csv and
+        # the held-out errors to <path>/driftCrossValidation.csv.
+        A, b = self.designMatrix()
+        n = len(b) // 3
+        A = A.reshape(n, 3, self.paramsNum)
+        b = b.reshape(n, 3)
+        w = np.ones(n) if weights is None else np.asarray(weights, dtype=float)
+
+        rng = np.random.default_rng(seed)
+        samples = [rng.integers(0, n, n) for _ in range(resamples)]
+        folds = max(2, min(folds, n))
+        perm = rng.permutation(n)
+        jobs = [(np.setdiff1d(perm, f), f) for f in np.array_split(perm, folds)]
+
+        initFitWorker(A, b, w)
+        estimate = fitSamples(np.arange(n))
+        with multiprocessing.Pool(workers, initializer=initFitWorker,
+            initargs=(A, b, w)) as pool:
+            boot = np.array(pool.map(fitSamples, samples,
+                chunksize=max(1, resamples // (4 * (workers or multiprocessing.cpu_count())))))
+            cv = pool.map(foldErrors, jobs)
+
+        lo, hi = np.percentile(boot, [(100 - ci) / 2, 100 - (100 - ci) / 2], axis=0)
+        cvParams = np.array([c[0] for c in cv])
+        uncertainty = pd.DataFrame({'param': PARAM_NAMES, 'estimate': estimate,
+            'bootstrapMean': boot.mean(axis=0), 'bootstrapStd': boot.std(axis=0, ddof=1),
+            'ciLow': lo, 'ciHigh': hi, 'cvMean': cvParams.mean(axis=0),
+            'cvStd': cvParams.std(axis=0, ddof=1)})
+        uncertainty.to_csv(self.path + '/driftUncertainty.csv', index=False)
+
+        crossValidation = pd.DataFrame([[k, len(jobs[k][0]), c[3], c[1], c[2]]
+            for k, c in enumerate(cv)], columns=['fold', 'trainSamples', 'testSamples',
+            'heldOutRms', 'heldOutMedian'])
+        for j, name in enumerate(PARAM_NAMES):
+            crossValidation[name] = cvParams[:, j]
+        crossValidation.to_csv(self.path + '/driftCrossValidation.csv', index=False)
+
+        heldOutRms = np.sqrt(np.sum([c[1]**2 * c[3] for c in cv]) / n)
+        print(uncertainty.to_string(index=False))
+        print("held-out RMS error over {} folds: {:.4f} m".format(folds, heldOutRms))
+        return uncertainty, crossValidation
+
+
+    def paramsDict(self):
+
+        p = self.params.ravel().tolist()
+        return dict(zip(ROBUST_PARAM_NAMES, p[:1] + [self.yaw, self.timeOffset] + p[1:]))
+
+
+    def saveModel(self, cov, stats, method, names=PARAM_NAMES):
+
+        model = {'model': 'corrected = scale*Rz(yaw)*odom(t + timeOffset) + '
+                'drift*t + offset',
+            'method': method,
+            'interp': self.interp,
+            'params': self.paramsDict(),
+            'stdErrors': dict(zip(names, np.sqrt(np.diag(cov)).tolist())),
+            'covariance': {'names': list(names), 'matrix': cov.tolist()},
+            'residuals': stats}
+        with open(self.modelFileName, 'w') as f:
+            yaml.safe_dump(model, f, sort_keys=False)
+        print("Drift model saved to " + self.modelFileName)
+
+
+    def loadModel(self):
+
+        params, self.yaw, self.timeOffset, interp = readModel(self.modelFileName)
+        self.params = params.reshape(self.paramsNum,1)
+        self.interp = samplingMethod(interp, self.timeOffset, args.interp)
+
+
 
 if __name__ == '__main__' :
 
-    odpd = OptimizeDronePoseData(args.path)
-    # odpd.gradientDescentOptimize()
-    odpd.visualize()
+    # The streaming mode does not load the whole odometry
+    odpd = None if args.mode == 'apply' else OptimizeDronePoseData(args.path)
+
+    if args.mode == 'apply':
+        applyModelStream(args.path, args.chunkRows, args.interp)
+
+    elif args.mode == 'solve':
+        weights = odpd.markerWeights() if args.weights == 'confidence' else None
+        cov, stats = odpd.leastSquaresOptimize(weights)
+        print("params: ", np.transpose(odpd.params))
+        print("std errors: ", np.sqrt(np.diag(cov)))
+        print("residuals: ", stats)
+        odpd.saveModel(cov, stats, 'leastSquares')
+
+    elif args.mode == 'robust':
+        weights = odpd.markerWeights() if args.weights == 'confidence' else None
+        cov, stats = odpd.robustOptimize(weights, args.loss, args.lossScale,
+            args.maxIter)
+        print("params: ", odpd.paramsDict())
+        print("std errors: ", np.sqrt(np.diag(cov)))
+        print("residuals: ", stats)
+        odpd.saveModel(cov, stats, 'robust', ROBUST_PARAM_NAMES)
+
+    elif args.mode == 'uncertainty':
+        weights = odpd.markerWeights() if args.weights == 'confidence' else None
+        odpd.resampleUncertainty(weights, args.resamples, args.folds, args.ci,
+            args.workers, args.seed)
+
+    elif args.mode == 'descent':
+        if os.path.exists(odpd.modelFileName):
+            odpd.loadModel()
+        converged = odpd.gradientDescentOptimize()
+        cov, stats = odpd.fitStats()
+        stats['converged'] = bool(converged)
+        print("params: ", odpd.paramsDict())
+        print("std errors: ", np.sqrt(np.diag(cov)))
+        print("residuals: ", stats)
+        odpd.saveModel(cov, stats, 'gradientDescent')
+
+    else:
+        odpd.loadModel()
+        odpd.visualize()
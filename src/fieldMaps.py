@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+import cv2 as cv
+import numpy as np
+
+
+# Lookup maps for cv.remap that compose the per-frame geometry of
+# objectGTGeneration.py (undistortion, ROI crop, field homography), so that
+# each output needs a single resampling. The maps are returned in the
+# fixed-point CV_16SC2 format, which cv.remap reads fastest.
+
+
+def fixedPoint(x, y, srcSize):
+
+	# Coordinates far out of the source would overflow the 16-bit maps; they
+	# are only clipped to just outside of it, where they still read the border
+	w, h = srcSize
+	x = np.clip(x, -2, w + 1).astype(np.float32)
+	y = np.clip(y, -2, h + 1).astype(np.float32)
+	return cv.convertMaps(x, y, cv.CV_16SC2)
+
+
+def homographyGrid(H, dstSize):
+
+	# Source coordinates of each destination pixel of cv.warpPerspective(H)
+	w, h = dstSize
+	u, v = np.meshgrid(np.arange(w, dtype=np.float64), np.arange(h, dtype=np.float64))
+	Hi = np.linalg.inv(H)
+	d = Hi[2,0]*u + Hi[2,1]*v + Hi[2,2]
+	d = np.where(np.abs(d) < 1e-12, 1e-12, d)
+	x = (Hi[0,0]*u + Hi[0,1]*v + Hi[0,2]) / d
+	y = (Hi[1,0]*u + Hi[1,1]*v + Hi[1,2]) / d
+	return x, y
+
+
+def roiOffset(roi):
+
+	if roi is None:
+		return 0, 0
+	return int(roi[0]), int(roi[1])
+
+
+def roiMaps(mapx, mapy, roi, frameSize):
+
+	# Rectification of the ROI only: the undistortion maps cut to the ROI
+	x0, y0 = roiOffset(roi)
+	if roi is None:
+		x1, y1 = frameSize
+	else:
+		x1, y1 = x0 + int(roi[2]), y0 + int(roi[3])
+	return fixedPoint(mapx[y0:y1, x0:x1], mapy[y0:y1, x0:x1], frameSize)
+
+
+def fieldMaps(H, dstSize, roiSize):
+
+	# From the (rectified) ROI crop to the field map
+	x, y = homographyGrid(H, dstSize)
+	return fixedPoint(x, y, roiSize)
+
+
+def fusedFieldMaps(H, dstSize, roi, frameSize, mapx=None, mapy=None):
+
+	# From the raw frame to the field map: the homography, then the ROI
+	# offset, then the undistortion maps sampled at the resulting points.
+	# Points out of the ROI stay black, as in the warp of the crop.
+	x, y = homographyGrid(H, dstSize)
+	x0, y0 = roiOffset(roi)
+	w, h = frameSize if roi is None else (int(roi[2]), int(roi[3]))
+	outside = (x < -0.5) | (y < -0.5) | (x > w - 0.5) | (y > h - 0.5)
+	x = (x + x0).astype(np.float32)
+	y = (y + y0).astype(np.float32)
+	if not mapx is None and not mapy is None:
+		rx = cv.remap(mapx, x, y, cv.INTER_LINEAR, borderMode=cv.BORDER_REPLICATE)
+		ry = cv.remap(mapy, x, y, cv.INTER_LINEAR, borderMode=cv.BORDER_REPLICATE)
+		x, y = rx, ry
+	x[outside] = -2
+	y[outside] = -2
+	return fixedPoint(x, y, frameSize)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+import cv2 as cv
+import numpy as np
+
+
+# Channels of the 8-bit encodings of sensor_msgs/Image that are decoded
+CHANNELS = {'bgr8': 3, 'rgb8': 3, 'bgra8': 4, 'rgba8': 4, 'mono8': 1,
+	'8UC1': 1, '8UC3': 3, '8UC4': 4}
+
+TO_BGR = {'rgb8': cv.COLOR_RGB2BGR, 'bgra8': cv.COLOR_BGRA2BGR,
+	'rgba8': cv.COLOR_RGBA2BGR, 'mono8': cv.COLOR_GRAY2BGR,
+	'8UC1': cv.COLOR_GRAY2BGR, '8UC4': cv.COLOR_BGRA2BGR}
+
+TO_GRAY = {'bgr8': cv.COLOR_BGR2GRAY, 'rgb8': cv.COLOR_RGB2GRAY,
+	'bgra8': cv.COLOR_BGRA2GRAY, 'rgba8': cv.COLOR_RGBA2GRAY,
+	'8UC3': cv.COLOR_BGR2GRAY, '8UC4': cv.COLOR_BGRA2GRAY}
+
+
+def imgmsgToArray(msg):
+
+	# A read-only view on the message buffer, without any copy. The rows may
+	# be padded ('step'), in which case the view is strided.
+	channels = CHANNELS.get(msg.encoding)
+	if channels is None:
+		raise ValueError("Unsupported image encoding: " + str(msg.encoding))
+
+	buf = np.frombuffer(msg.data, dtype=np.uint8, count=msg.height * msg.step)
+	img = buf.reshape(msg.height, msg.step)[:, :msg.width * channels]
+	if channels == 1:
+		return img
+	return img.reshape(msg.height, msg.width, channels)
+
+
+def imgmsgToBgr(msg):
+
+	# Only converted (and so copied) when the encoding is not already BGR
+	img = imgmsgToArray(msg)
+	if msg.encoding in TO_BGR:
+		return cv.cvtColor(img, TO_BGR[msg.encoding])
+	return img
+
+
+def imgmsgToGray(msg, bgr=None):
+
+	# The marker detection only needs the intensities. 'bgr' is the already
+	# decoded colour image, if any, to convert from.
+	if CHANNELS.get(msg.encoding) == 1:
+		return imgmsgToArray(msg)
+	if not bgr is None:
+		return cv.cvtColor(bgr, cv.COLOR_BGR2GRAY)
+	return cv.cvtColor(imgmsgToArray(msg), TO_GRAY[msg.encoding])
+
+
+def writable(img):
+
+	# The image itself if it can be drawn on, or a copy of it
+	return img if img.flags.writeable else img.copy()
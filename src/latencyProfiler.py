@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+
+import numpy as np
+import json
+import threading
+import time
+
+
+# Histogram bin edges (seconds), log spaced from 10 us to 10 s, shared by all
+# the timers so that memory and cost per sample stay constant
+BIN_EDGES = np.concatenate(([0.0], np.logspace(-5, 1, 61), [np.inf]))
+
+
+class Histogram:
+
+	def __init__(self):
+
+		self.counts = np.zeros(len(BIN_EDGES) - 1, dtype=np.int64)
+		self.n = 0
+		self.sum = 0.0
+		self.max = 0.0
+
+
+	def add(self, value):
+
+		self.counts[np.searchsorted(BIN_EDGES, value, side='right') - 1] += 1
+		self.n += 1
+		self.sum += value
+		if value > self.max:
+			self.max = value
+
+
+	def percentile(self, q):
+
+		# Upper edge of the bin holding the q-th percentile (max for the last bin)
+		if self.n == 0:
+			return float('nan')
+		k = int(np.searchsorted(np.cumsum(self.counts), q / 100.0 * self.n))
+		return float(min(BIN_EDGES[k + 1], self.max))
+
+
+	def summary(self):
+
+		return {'count': self.n,
+			'mean_ms': 1000 * self.sum / self.n if self.n else float('nan'),
+			'p50_ms': 1000 * self.percentile(50), 'p95_ms': 1000 * self.percentile(95),
+			'p99_ms': 1000 * self.percentile(99), 'max_ms': 1000 * self.max}
+
+
+class LatencyProfiler:
+
+	# Per-stage timers of the callbacks. A callback calls 'begin' on entry,
+	# 'lap' after each stage (timed from the previous lap) and 'end' on exit;
+	# the callback being timed is kept per thread, as rospy runs each
+	# subscriber on its own. The lag of a callback behind its message
+	# ('queue lag') is only measured live, as the growth of the wall time
+	# since the first message over the stamp time since it, so that it does
+	# not depend on the stamps being on the wall clock (rosbag play without
+	# --clock). Message drops are counted from the gaps in the header sequence
+	# numbers.
+
+	def __init__(self, period=0, wallClock=True):
+
+		self._period = period
+		self._wallClock = wallClock
+		self._timers = {}
+		self._lastSeq = {}
+		self._received = {}
+		self._gaps = {}
+		self._counters = {}
+		self._startTime = time.time()
+		self._lastReport = self._startTime
+		self._lastReportNum = 0
+		self._state = threading.local()
+		self._clockOrigin = None
+
+
+	def timer(self, name):
+
+		if not name in self._timers:
+			self._timers[name] = Histogram()
+		return self._timers[name]
+
+
+	def begin(self, callback, header=None):
+
+		now = time.perf_counter()
+		state = self._state
+		state.current = callback
+		state.beginTime = now
+		state.lapTime = now
+		self._received[callback] = self._received.get(callback, 0) + 1
+
+		if header is None:
+			return
+		if self._wallClock:
+			wall = time.time()
+			stamp = header.stamp.to_sec()
+			if self._clockOrigin is None:
+				self._clockOrigin = (wall, stamp)
+			wall0, stamp0 = self._clockOrigin
+			self.timer(callback + "/queue_lag").add(max(0.0,
+				(wall - wall0) - (stamp - stamp0)))
+		seq = getattr(header, 'seq', None)
+		if not seq is None:
+			last = self._lastSeq.get(callback)
+			if not last is None and seq > last + 1:
+				self._gaps[callback] = self._gaps.get(callback, 0) + seq - last - 1
+			self._lastSeq[callback] = seq
+
+
+	def lap(self, stage):
+
+		now = time.perf_counter()
+		state = self._state
+		self.timer(state.current + "/" + stage).add(now - state.lapTime)
+		state.lapTime = now
+
+
+	def end(self):
+
+		now = time.perf_counter()
+		state = self._state
+		self.timer(state.current + "/total").add(now - state.beginTime)
+		if self._period > 0 and time.time() - self._lastReport >= self._period:
+			self.report()
+
+
+	def syncDelay(self, delay):
+
+		# Image time minus the matched odometry time
+		self.timer("sync_delay").add(abs(delay))
+
+
+	def count(self, name, n=1):
+
+		self._counters[name] = self._counters.get(name, 0) + n
+
+
+	def setCounter(self, name, value):
+
+		self._counters[name] = value
+
+
+	def report(self):
+
+		now = time.time()
+		images = self._received.get('image', 0)
+		rate = (images - self._lastReportNum) / max(now - self._lastReport, 1e-9)
+		self._lastReport = now
+		self._lastReportNum = images
+
+		line = "[profile] {} images ({:.1f}/s)".format(images, rate)
+		total = self._timers.get("image/total")
+		if not total is None:
+			line += ", image {:.1f}/{:.1f} ms (p50/p95)".format(
+				1000 * total.percentile(50), 1000 * total.percentile(95))
+		lag = self._timers.get("image/queue_lag")
+		if not lag is None:
+			line += ", lag p95 {:.1f} ms".format(1000 * lag.percentile(95))
+		sync = self._timers.get("sync_delay")
+		if not sync is None:
+			line += ", sync p95 {:.1f} ms".format(1000 * sync.percentile(95))
+		if self._gaps:
+			line += ", seq gaps " + str(self._gaps)
+		print(line)
+
+
+	def summary(self):
+
+		elapsed = time.time() - self._startTime
+		return {'elapsed_s': elapsed,
+			'received': dict(self._received),
+			'rate_hz': {k: v / max(elapsed, 1e-9) for k, v in self._received.items()},
+			'seq_gaps': dict(self._gaps),
+			'counters': dict(self._counters),
+			'timers': {k: h.summary() for k, h in sorted(self._timers.items())}}
+
+
+	def export(self, jsonFileName, csvFileName=None):
+
+		# The JSON holds the whole summary; the CSV one row per timer, with the
+		# histogram bin counts for plotting
+		with open(jsonFileName, 'w') as f:
+			json.dump(self.summary(), f, indent=2)
+
+		if csvFileName is None:
+			return
+		with open(csvFileName, 'w') as f:
+			f.write("timer,count,mean_ms,p50_ms,p95_ms,p99_ms,max_ms," +
+				",".join(["le_{:g}ms".format(1000 * e) for e in BIN_EDGES[1:]]) + "\n")
+			for name, h in sorted(self._timers.items()):
+				s = h.summary()
+				f.write(",".join([name] + [repr(float(s[k])) for k in ('count', 'mean_ms',
+					'p50_ms', 'p95_ms', 'p99_ms', 'max_ms')] +
+					[str(c) for c in h.counts]) + "\n")
+
+
+class NullProfiler:
+
+	# Used when profiling is off, so the callbacks call the same methods
+
+	def begin(self, callback, header=None):
+		pass
+
+	def lap(self, stage):
+		pass
+
+	def end(self):
+		pass
+
+	def syncDelay(self, delay):
+		pass
+
+	def count(self, name, n=1):
+		pass
+
+	def setCounter(self, name, value):
+		pass
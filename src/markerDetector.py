@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+
+import cv2 as cv
+import numpy as np
+
+
+class ArucoDetector:
+
+	# Wraps cv.aruco.detectMarkers. With 'tracking' set, the search is first
+	# done in a padded region around the last detection (shifted by its last
+	# motion), and the full frame is searched only after 'maxMisses' missed
+	# region searches in a row, or every 'refreshPeriod' frames so that new
+	# markers entering the view are not missed for long.
+	# With 'scale' below 1, the candidates are found on the downscaled image
+	# and only their corners are refined on the full resolution one.
+	# Given a DetectionCache, frames seen before are not searched again.
+
+	def __init__(self, arucoDict, arucoParams, validIds=None, tracking=False,
+		padding=0.5, minPadding=20, maxMisses=3, refreshPeriod=30, scale=1.0,
+		cache=None):
+
+		self._arucoDict = arucoDict
+		self._arucoParams = arucoParams
+		self._validIds = validIds
+		self._tracking = tracking
+		self._padding = padding
+		self._minPadding = minPadding
+		self._maxMisses = maxMisses
+		self._refreshPeriod = refreshPeriod
+		self._scale = scale
+		self._cache = cache
+		self._subPixCriteria = (cv.TERM_CRITERIA_EPS + cv.TERM_CRITERIA_MAX_ITER,
+			30, 0.01)
+		# The refinement window must cover the error of the upscaled corners
+		self._subPixWin = max(3, int(np.ceil(1.0 / scale)) + 1)
+
+		self.reset()
+
+		self.roiSearchesNum = 0
+		self.roiHitsNum = 0
+		self.fullSearchesNum = 0
+		self.fullHitsNum = 0
+
+
+	def reset(self):
+
+		# Forgets the tracked region, as before the first frame
+		self._bbox = None
+		self._velocity = np.zeros(2)
+		self._misses = 0
+		self._sinceFull = 0
+
+
+	def detect(self, img):
+
+		if self._cache is None:
+			return self.search(img)
+
+		key = self._cache.key(img)
+		cached = self._cache.get(key)
+		if not cached is None:
+			corners, ids = cached
+			if self.hasValid(ids):
+				self._misses = 0
+				self.track(corners, ids)
+			else:
+				self._bbox = None
+			return corners, ids, ()
+
+		corners, ids, rejected = self.search(img)
+		self._cache.put(key, corners, ids)
+		return corners, ids, rejected
+
+
+	def search(self, img):
+
+		if self._tracking and not self._bbox is None and \
+			self._sinceFull < self._refreshPeriod:
+
+			self._sinceFull += 1
+			self.roiSearchesNum += 1
+			corners, ids, rejected = self.detectInRoi(img, self.searchRoi(img))
+			if self.hasValid(ids):
+				self.roiHitsNum += 1
+				self._misses = 0
+				self.track(corners, ids)
+				return corners, ids, rejected
+
+			self._misses += 1
+			if self._misses < self._maxMisses:
+				return corners, ids, rejected
+
+		self._sinceFull = 0
+		self._misses = 0
+		self.fullSearchesNum += 1
+		corners, ids, rejected = self.detectScaled(img)
+		if self.hasValid(ids):
+			self.fullHitsNum += 1
+			self.track(corners, ids)
+		else:
+			self._bbox = None
+		return corners, ids, rejected
+
+
+	def detectInRoi(self, img, roi):
+
+		x0, y0, x1, y1 = roi
+		corners, ids, rejected = self.detectScaled(img[y0:y1, x0:x1])
+		offset = np.array([x0, y0], dtype=np.float32)
+		corners = tuple([c + offset for c in corners])
+		rejected = tuple([c + offset for c in rejected])
+		return corners, ids, rejected
+
+
+	def detectScaled(self, img):
+
+		if self._scale >= 1.0:
+			return cv.aruco.detectMarkers(img, self._arucoDict,
+				parameters=self._arucoParams)
+
+		if len(img.shape) == 3:
+			gray = cv.cvtColor(img, cv.COLOR_BGR2GRAY)
+		else:
+			gray = img
+		small = cv.resize(gray, None, fx=self._scale, fy=self._scale,
+			interpolation=cv.INTER_AREA)
+		corners, ids, rejected = cv.aruco.detectMarkers(small, self._arucoDict,
+			parameters=self._arucoParams)
+		if ids is None:
+			return (), None, tuple([c / self._scale for c in rejected])
+
+		# Pixel centres move by half a pixel between the two resolutions
+		shift = 0.5 / self._scale - 0.5
+		refined = []
+		for c in corners:
+			pts = (c.reshape(-1, 1, 2) / self._scale + shift).astype(np.float32)
+			cv.cornerSubPix(gray, pts, (self._subPixWin, self._subPixWin), (-1, -1),
+				self._subPixCriteria)
+			refined.append(pts.reshape(c.shape))
+		return tuple(refined), ids, tuple([c / self._scale for c in rejected])
+
+
+	def hasValid(self, ids):
+
+		if ids is None:
+			return False
+		if self._validIds is None:
+			return True
+		return any([int(i) in self._validIds for i in ids.flatten()])
+
+
+	def track(self, corners, ids):
+
+		pts = [c.reshape(-1, 2) for c, i in zip(corners, ids.flatten())
+			if self._validIds is None or int(i) in self._validIds]
+		pts = np.concatenate(pts, axis=0)
+		bbox = np.concatenate((pts.min(axis=0), pts.max(axis=0)))
+
+		if not self._bbox is None:
+			self._velocity = (bbox[:2] + bbox[2:]) / 2 - \
+				(self._bbox[:2] + self._bbox[2:]) / 2
+		else:
+			self._velocity = np.zeros(2)
+		self._bbox = bbox
+
+
+	def searchRoi(self, img):
+
+		h, w = img.shape[:2]
+		size = self._bbox[2:] - self._bbox[:2]
+		pad = np.maximum(size * self._padding, self._minPadding)
+		lo = self._bbox[:2] + self._velocity - pad
+		hi = self._bbox[2:] + self._velocity + pad
+		x0 = int(min(max(lo[0], 0), w - 1))
+		y0 = int(min(max(lo[1], 0), h - 1))
+		x1 = int(min(max(hi[0], x0 + 1), w))
+		y1 = int(min(max(hi[1], y0 + 1), h))
+		return x0, y0, x1, y1
+
+
+	def stats(self):
+
+		return {'roiSearches': self.roiSearchesNum, 'roiHits': self.roiHitsNum,
+			'roiMisses': self.roiSearchesNum - self.roiHitsNum,
+			'fullSearches': self.fullSearchesNum, 'fullHits': self.fullHitsNum,
+			'fullMisses': self.fullSearchesNum - self.fullHitsNum,
+			'cache': None if self._cache is None else self._cache.stats()}
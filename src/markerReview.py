@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+
+import cv2 as cv
+import numpy as np
+import json
+import os
+import re
+import shutil
+import threading
+
+
+GUIDE = "Marker frame review GUIDE:" + \
+	"\n \t click: select/unselect a frame to delete" + \
+	"\n \t a: select/unselect the whole page" + \
+	"\n \t n, space: next page" + \
+	"\n \t p: previous page" + \
+	"\n \t q: quit (the progress is saved and resumed next time)"
+
+
+def frameIndex(fileName):
+
+	m = re.match(r"img(\d+)\.jpg$", os.path.basename(fileName))
+	return int(m.group(1)) if m else None
+
+
+def listMarkerFrames(markerImagesDir):
+
+	# The frames are numbered in the order their poses are logged, which the
+	# file mtime does not always follow
+	names = [n for n in os.listdir(markerImagesDir) if not frameIndex(n) is None]
+	return [os.path.join(markerImagesDir, n) for n in sorted(names, key=frameIndex)]
+
+
+def clearReview(saveDir):
+
+	if os.path.exists(saveDir + "/markerThumbnails"):
+		shutil.rmtree(saveDir + "/markerThumbnails")
+	if os.path.exists(saveDir + "/markerReview.json"):
+		os.remove(saveDir + "/markerReview.json")
+
+
+class MarkerFrameReview:
+
+	# Shows the marker frames as pages of thumbnails. The thumbnails are decoded
+	# ahead of the shown page in a background thread and cached on the disk, so
+	# that later sessions start at once. The selection and the current page
+	# are saved on every page change, so a review can be resumed.
+
+	def __init__(self, saveDir, frames, rows=3, cols=4, thumbWidth=320,
+		pagesAhead=4):
+
+		self._frames = frames
+		self._rows = rows
+		self._cols = cols
+		self._perPage = rows * cols
+		self._thumbWidth = thumbWidth
+		self._pagesAhead = pagesAhead
+		self._pagesNum = max(1, int(np.ceil(len(frames) / self._perPage)))
+		self._thumbsDir = saveDir + "/markerThumbnails"
+		self._progressFileName = saveDir + "/markerReview.json"
+		self._window = "marker frames"
+
+		self._thumbs = {}
+		self._thumbSize = None
+		self._cond = threading.Condition()
+		self._stop = False
+		self._page = 0
+		self._selected = set()
+
+		if not os.path.exists(self._thumbsDir):
+			os.mkdir(self._thumbsDir)
+		self.loadProgress()
+
+
+	def loadProgress(self):
+
+		if not os.path.exists(self._progressFileName):
+			return
+
+		with open(self._progressFileName) as f:
+			progress = json.load(f)
+
+		names = [os.path.basename(fr) for fr in self._frames]
+		if progress.get('frames') != names:
+			print("The saved review is of other frames; starting over.")
+			return
+
+		self._page = min(progress['page'], self._pagesNum - 1)
+		self._selected = set(progress['selected'])
+		print("Resuming the review at page {}/{}".format(self._page + 1, self._pagesNum))
+
+
+	def saveProgress(self, done=False):
+
+		progress = {'frames': [os.path.basename(fr) for fr in self._frames],
+			'page': self._page, 'selected': sorted(self._selected), 'done': done}
+		with open(self._progressFileName + ".tmp", 'w') as f:
+			json.dump(progress, f)
+		os.replace(self._progressFileName + ".tmp", self._progressFileName)
+
+
+	def loadThumb(self, k):
+
+		fileName = self._frames[k]
+		thumbName = os.path.join(self._thumbsDir, os.path.basename(fileName))
+		if os.path.exists(thumbName) and \
+			os.path.getmtime(thumbName) >= os.path.getmtime(fileName):
+			thumb = cv.imread(thumbName)
+			if not thumb is None:
+				return thumb
+
+		# The reduced decoding skips most of the full size JPEG work
+		img = cv.imread(fileName, cv.IMREAD_REDUCED_COLOR_2)
+		if img is None:
+			img = np.zeros((240, 320, 3), dtype=np.uint8)
+		h = int(round(img.shape[0] * self._thumbWidth / img.shape[1]))
+		thumb = cv.resize(img, (self._thumbWidth, h), interpolation=cv.INTER_AREA)
+		cv.imwrite(thumbName, thumb)
+		return thumb
+
+
+	def prefetch(self):
+
+		while True:
+			with self._cond:
+				if self._stop:
+					return
+				lo = self._page * self._perPage
+				hi = min(len(self._frames), lo + (self._pagesAhead + 1) * self._perPage)
+				# Only the pages around the shown one are kept in memory
+				for k in list(self._thumbs.keys()):
+					if k < lo - self._perPage or k >= hi:
+						del self._thumbs[k]
+				todo = [k for k in range(lo, hi) if not k in self._thumbs]
+				if not todo:
+					self._cond.wait()
+					continue
+				k = todo[0]
+
+			thumb = self.loadThumb(k)
+			with self._cond:
+				self._thumbs[k] = thumb
+				if self._thumbSize is None:
+					self._thumbSize = thumb.shape[:2]
+				self._cond.notify_all()
+
+
+	def getThumb(self, k):
+
+		with self._cond:
+			while not k in self._thumbs:
+				self._cond.wait()
+			return self._thumbs[k]
+
+
+	def drawPage(self):
+
+		lo = self._page * self._perPage
+		hi = min(len(self._frames), lo + self._perPage)
+		thumbs = [self.getThumb(k) for k in range(lo, hi)]
+		h, w = self._thumbSize
+		sheet = np.zeros((h * self._rows, w * self._cols, 3), dtype=np.uint8)
+
+		for j, thumb in enumerate(thumbs):
+			k = lo + j
+			y = (j // self._cols) * h
+			x = (j % self._cols) * w
+			thumb = thumb[:h, :w]
+			sheet[y:y+thumb.shape[0], x:x+thumb.shape[1]] = thumb
+			cv.putText(sheet, str(frameIndex(self._frames[k])), (x + 5, y + 20),
+				cv.FONT_HERSHEY_SIMPLEX, 0.6, (255, 0, 255), 2)
+			if k in self._selected:
+				cv.rectangle(sheet, (x + 2, y + 2), (x + w - 3, y + h - 3), (0, 0, 255), 4)
+				cv.line(sheet, (x, y), (x + w, y + h), (0, 0, 255), 2)
+				cv.line(sheet, (x + w, y), (x, y + h), (0, 0, 255), 2)
+
+		cv.putText(sheet, "page {}/{}".format(self._page + 1, self._pagesNum),
+			(5, sheet.shape[0] - 10), cv.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+		cv.imshow(self._window, sheet)
+
+
+	def mouseCallback(self, event, x, y, flags, param):
+
+		if event != cv.EVENT_LBUTTONUP or self._thumbSize is None:
+			return
+		h, w = self._thumbSize
+		k = self._page * self._perPage + (y // h) * self._cols + x // w
+		if x // w < self._cols and k < len(self._frames):
+			self._selected ^= {k}
+			self.drawPage()
+
+
+	def setPage(self, page):
+
+		with self._cond:
+			self._page = page
+			self._cond.notify_all()
+
+
+	def run(self):
+
+		# Returns the sorted positions (in frame order) of the selected frames,
+		# or None if the review is quit before the last page
+		if len(self._frames) == 0:
+			return []
+
+		print(GUIDE)
+		th = threading.Thread(target=self.prefetch)
+		th.daemon = True
+		th.start()
+		cv.namedWindow(self._window)
+		cv.setMouseCallback(self._window, self.mouseCallback)
+
+		done = False
+		while True:
+			self.drawPage()
+			key = cv.waitKey()
+
+			if key == ord('q'):
+				break
+
+			elif key == ord('a'):
+				lo = self._page * self._perPage
+				page = set(range(lo, min(len(self._frames), lo + self._perPage)))
+				if page <= self._selected:
+					self._selected -= page
+				else:
+					self._selected |= page
+
+			elif key == ord('p'):
+				self.setPage(max(0, self._page - 1))
+				self.saveProgress()
+
+			elif key in (ord('n'), ord(' ')):
+				if self._page == self._pagesNum - 1:
+					done = True
+					break
+				self.setPage(self._page + 1)
+				self.saveProgress()
+
+		self.saveProgress(done)
+		with self._cond:
+			self._stop = True
+			self._cond.notify_all()
+		cv.destroyWindow(self._window)
+
+		return sorted(self._selected) if done else None
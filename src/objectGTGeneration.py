@@ -1,20 +1,37 @@
 #!/usr/bin/env python
 
 import cv2 as cv
-import pandas as pd
 # import math
-# import yaml
+import yaml
 import numpy as np
-# import time
+import time
 from enum import Enum
-# import os
+import os
 import sys
+from poseLogger import PoseLogger, removeLog
+import fieldMaps
+from videoPairReader import VideoPairReader
 
 import argparse
 parser = argparse.ArgumentParser()
 parser.add_argument('-p', '--path', help='The Path to Save the Output.', dest='path')
 parser.add_argument('-f', '--front', help='The Path to the Front File.', dest='front')
 parser.add_argument('-s', '--side', help='The Path to the Side File.', dest='side')
+parser.add_argument('--headless', help='Process with the ROIs and field corners of '
+	'testData.py, without any window, drawing or key polling.', dest='headless',
+	action='store_true')
+parser.add_argument('--batch', help='Headless run as fast as the videos decode, '
+	'rewriting <path>/objectPoses.csv (needs <path>/fieldCalibration.yaml or the field '
+	'corners in testData.py).', dest='batch', action='store_true')
+parser.add_argument('--delay', help='Milliseconds each frame is shown for in the '
+	'interactive mode.', dest='delay', type=int, default=50)
+parser.add_argument('--localization', help='Locate the object from the AND of the warped '
+	'line images (\'raster\') or by intersecting the two view lines on the field '
+	'(\'geometric\', also saving objectPoseUncertainty.csv).', dest='localization',
+	choices=['raster', 'geometric'], default='raster')
+parser.add_argument('--no-video-index', help='Seek with cap.set and count the time by '
+	'the fps, instead of the cached keyframe/timestamp index of each video.',
+	dest='videoIndex', action='store_false')
 args, unknown = parser.parse_known_args()
 
 sys.path.insert(1, args.path)
@@ -71,6 +88,7 @@ class MovingObjectGroundTruthGeneration:
 		initFrame_f = testData.initFrame_f
 		initFrame_s = testData.initFrame_s
 		self._fps = testData.fps
+		self._calibFileName = save_dir + "/fieldCalibration.yaml"
 
 		# CAMERA PARAMS:
 		self._intrinsics_front = None
@@ -82,6 +100,11 @@ class MovingObjectGroundTruthGeneration:
 		self._mapx_side = None
 		self._mapy_side = None
 		self._isRectificationInitialized = False
+		# Per view remap maps, rebuilt when the ROI or the homography changes:
+		# raw frame -> rectified ROI, ROI -> field map, raw frame -> field map
+		self._frameSizes = {}
+		self._maps = {}
+		self._mapsKey = {}
 		# self._intrinsics_side = np.float32([ [843.930250, 0.000000, 950.421246],
 		# 									[0.000000, 861.669778, 577.905765],
 		# 									[0.000000, 0.000000, 1.000000]])
@@ -89,37 +112,73 @@ class MovingObjectGroundTruthGeneration:
 
 		# VIDEO PLAYBACK PARAMS:
 		self._go = True
-		self._delay = 50
+		self._delay = args.delay
 		self._it = 0
-		self._cap_front = cv.VideoCapture(videoFile_front)
-		self._cap_front.set(1,initFrame_f)
-		self._cap_side = cv.VideoCapture(videoFile_side)
-		self._cap_side.set(1,initFrame_s)
+		# Both videos are decoded ahead, on their own threads
+		self._videos = VideoPairReader(videoFile_front, videoFile_side, initFrame_f,
+			initFrame_s, indexed=args.videoIndex)
 		self._time = 0
 
 		# UI PARAMS:
+		self._batch = args.batch
+		self._headless = args.headless or args.batch
 		self._presetUI_front = "Front Frame"
 		self._presetUI_side = "Side Frame"
 		self._resultUI_front = "Front Result"
 		self._resultUI_side = "Side Result"
 		self._resultUI = "Final Result"
-		self._presetUIDestroyed_front = False
-		self._presetUIDestroyed_side = False
-		cv.namedWindow(self._presetUI_front)
-		cv.namedWindow(self._presetUI_side)
-		cv.setMouseCallback(self._presetUI_front, self.mouseCallback_front)
-		cv.setMouseCallback(self._presetUI_side, self.mouseCallback_side)
-		print("MovingObjectGroundTruthGeneration GUIDE:" + \
-			"\n \t a: quit" + \
-			"\n \t s: crop ROI for front view" + \
-			"\n \t d: crop ROI for side view" + \
-			"\n \t f: start processing")
+		self._presetUIDestroyed_front = self._headless
+		self._presetUIDestroyed_side = self._headless
+		if not self._headless:
+			cv.namedWindow(self._presetUI_front)
+			cv.namedWindow(self._presetUI_side)
+			cv.setMouseCallback(self._presetUI_front, self.mouseCallback_front)
+			cv.setMouseCallback(self._presetUI_side, self.mouseCallback_side)
+			print("MovingObjectGroundTruthGeneration GUIDE:" + \
+				"\n \t a: quit" + \
+				"\n \t s: crop ROI for front view" + \
+				"\n \t d: crop ROI for side view" + \
+				"\n \t f: start processing")
 
 		# HOMOGRAPHIC TRANSFORM MEMBERS:
 		self._homo_front = None
 		self._homo_side = None
 		self._dstPts = np.array([[0, 0],[959, 0],[959, 719],[0, 719]])
 		self._pixelMapSize = (960, 720)
+		self.loadCalibration()
+
+		# Headless, the saved calibration or the field corners of testData.py
+		# take the place of the 'f' key
+		if self._headless:
+			if (self._homo_front is None) or (self._homo_side is None):
+				self.calcTransforms()
+			if (self._homo_front is None) or (self._homo_side is None):
+				raise ValueError("Headless mode needs " + self._calibFileName +
+					" or the four field corners of both views in testData.py")
+
+		# OUTPUT:
+		# A batch run rewrites the poses; otherwise they are appended as before
+		self._objectPosesFileName = self._saveDir + "/objectPoses.csv"
+		if self._batch:
+			removeLog(self._objectPosesFileName)
+		self._poseLogger = PoseLogger(self._objectPosesFileName,
+			columns=('Xs', 'Ys', 'Time'), timeText=False,
+			batchRows=1000 if self._batch else 50)
+
+		# GEOMETRIC LOCALIZATION MEMBERS:
+		# The detected column, its uncertainty (pixels) and the ROI height of
+		# each view; headless, no line images are drawn at all
+		self._geometric = args.localization == 'geometric'
+		self._drawLines = not (self._geometric and self._headless)
+		self._columns = {Views.FRONT: None, Views.SIDE: None}
+		self._uncertaintyLogger = None
+		if self._geometric:
+			self._uncertaintyFileName = self._saveDir + "/objectPoseUncertainty.csv"
+			if self._batch:
+				removeLog(self._uncertaintyFileName)
+			self._uncertaintyLogger = PoseLogger(self._uncertaintyFileName,
+				columns=('Time', 'SigmaX', 'SigmaY', 'CovXY'), timeText=False,
+				batchRows=1000 if self._batch else 50)
 
 		# MOTION DETECTION MEMBERS:
 		self._bgs_front = cv.createBackgroundSubtractorMOG2(varThreshold = 32)
@@ -181,46 +240,95 @@ class MovingObjectGroundTruthGeneration:
 			return frame
 
 
-	def crop(self, front, side):
+	def viewParams(self, view):
 
-		if not self._ROI_front is None:
-			image_f = front.copy()[int(self._ROI_front[1]):int(self._ROI_front[1]+self._ROI_front[3]),
-				int(self._ROI_front[0]):int(self._ROI_front[0]+self._ROI_front[2])]
-		else:
-			image_f = front.copy()
+		if view == Views.FRONT:
+			return self._ROI_front, self._homo_front, self._mapx_front, self._mapy_front
+		return self._ROI_side, self._homo_side, self._mapx_side, self._mapy_side
 
-		if not self._ROI_side is None:
-			image_s = side.copy()[int(self._ROI_side[1]):int(self._ROI_side[1]+self._ROI_side[3]),
-				int(self._ROI_side[0]):int(self._ROI_side[0]+self._ROI_side[2])]
-		else:
-			image_s = side.copy()
 
-		return image_f, image_s
+	def getMaps(self, view):
+
+		# The maps of the current ROI and homography of the view
+		roi, homo, mx, my = self.viewParams(view)
+		if not roi is None:
+			roi = tuple([int(v) for v in roi])
+		key = (roi, None if homo is None else homo.tobytes())
+		if self._mapsKey.get(view) == key:
+			return self._maps[view]
+
+		frameSize = self._frameSizes[view]
+		roiSize = frameSize if roi is None else (roi[2], roi[3])
+		maps = {'roi': None, 'field': None, 'fused': None}
+		if not mx is None and not my is None:
+			maps['roi'] = fieldMaps.roiMaps(mx, my, roi, frameSize)
+		if not homo is None:
+			maps['field'] = fieldMaps.fieldMaps(homo, self._pixelMapSize, roiSize)
+			maps['fused'] = fieldMaps.fusedFieldMaps(homo, self._pixelMapSize, roi,
+				frameSize, mx, my)
+		self._maps[view] = maps
+		self._mapsKey[view] = key
+		return maps
+
+
+	def cropView(self, frame, view):
+
+		# The rectified ROI in one remap, or a view on the frame without copying
+		roi = self.viewParams(view)[0]
+		maps = self.getMaps(view)
+		if not maps['roi'] is None:
+			return cv.remap(frame, maps['roi'][0], maps['roi'][1], cv.INTER_LINEAR)
+		if roi is None:
+			return frame
+		return frame[int(roi[1]):int(roi[1]+roi[3]), int(roi[0]):int(roi[0]+roi[2])]
+
+
+	def crop(self, front, side):
+
+		return self.cropView(front, Views.FRONT), self.cropView(side, Views.SIDE)
 
 
 	def process(self, frame_f, frame_s):
 
-		frame_f = self.rectify(frame_f, Views.FRONT)
-		frame_s = self.rectify(frame_s, Views.SIDE)
+		if not self._isRectificationInitialized:
+			self.initRectification(frame_f)
+			self._frameSizes = {Views.FRONT: (frame_f.shape[1], frame_f.shape[0]),
+				Views.SIDE: (frame_s.shape[1], frame_s.shape[0])}
 
 		image_f, image_s = self.crop(frame_f, frame_s)
-		self.switch(frame_f, frame_s)
+		if not self._headless:
+			# The whole rectified frames are only needed to select the ROIs
+			self.switch(self.rectify(frame_f, Views.FRONT),
+				self.rectify(frame_s, Views.SIDE))
 
 		motion_f, m_f = self.detectMotion(image_f, Views.FRONT)
 		motion_s, m_s = self.detectMotion(image_s, Views.SIDE)
 
-		transformedView_f, transformedView_s = self.transformViews(image_f, image_s)
-		transformedPath_f, transformedPath_s = self.transformViews(motion_f, motion_s)
+		cov = None
+		if self._geometric:
+			x, y, cov = self.localizeGeometric()
 
-		result, vmm_front, vmm_side = self.getUnifiedMap(transformedPath_f,
-			transformedPath_s, transformedView_f, transformedView_s)
+		# The warped views are only drawn on; they are resampled from the raw
+		# frames at once
+		if not self._headless:
+			transformedView_f, transformedView_s = self.transformFrames(frame_f, frame_s)
+		else:
+			transformedView_f, transformedView_s = None, None
 
-		self.visualize(image_f, image_s, transformedPath_f, transformedPath_s,
-			m_f, m_s, result, vmm_front, vmm_side)
+		if self._drawLines:
+			transformedPath_f, transformedPath_s = self.transformViews(motion_f, motion_s)
+			result, vmm_front, vmm_side = self.getUnifiedMap(transformedPath_f,
+				transformedPath_s, transformedView_f, transformedView_s)
 
-		x, y = self.rescaleToMetric(result)
-		print(x, y)
-		self.savePath(x, y)
+		if not self._headless:
+			self.visualize(image_f, image_s, transformedPath_f, transformedPath_s,
+				m_f, m_s, result, vmm_front, vmm_side)
+
+		if not self._geometric:
+			x, y = self.rescaleToMetric(result)
+		if not self._batch:
+			print(x, y)
+		self.savePath(x, y, cov)
 
 
 	def getUnifiedMap(self, verLineImg, horLineImg, frontMap, sideMap):
@@ -230,6 +338,8 @@ class MovingObjectGroundTruthGeneration:
 		visualizedMotionMap_side = None
 		if not verLineImg is None and not horLineImg is None:
 			result = cv.bitwise_and(verLineImg, horLineImg, mask = None)
+
+		if not result is None and not frontMap is None and not sideMap is None:
 			res = np.zeros((self._pixelMapSize[1], self._pixelMapSize[0], 3),
 				dtype=np.uint8)
 
@@ -242,6 +352,66 @@ class MovingObjectGroundTruthGeneration:
 		return result, visualizedMotionMap_front, visualizedMotionMap_side
 
 
+	def intersectColumns(self, c_f, c_s):
+
+		# Each view's column x = c is the line (1, 0, -c) in the ROI, and
+		# H^-T (1, 0, -c) on the field map; the object is where the two meet.
+		# Returns the map pixel, or None if the lines meet out of the map or
+		# out of the vertical extent of either ROI.
+		hInv_f = np.linalg.inv(self._homo_front)
+		hInv_s = np.linalg.inv(self._homo_side)
+		l_f = hInv_f.T.dot([1.0, 0.0, -c_f])
+		l_s = hInv_s.T.dot([1.0, 0.0, -c_s])
+		p = np.cross(l_f, l_s)
+		if abs(p[2]) < 1e-12:
+			return None
+		u, v = p[0] / p[2], p[1] / p[2]
+		if u < 0 or v < 0 or u > self._pixelMapSize[0] - 1 or \
+			v > self._pixelMapSize[1] - 1:
+			return None
+
+		for hInv, column in ((hInv_f, self._columns[Views.FRONT]),
+			(hInv_s, self._columns[Views.SIDE])):
+			q = hInv.dot([u, v, 1.0])
+			if abs(q[2]) < 1e-12 or not 0 <= q[1] / q[2] <= column[2]:
+				return None
+		return u, v
+
+
+	def localizeGeometric(self):
+
+		# Metric x, y and their 2x2 covariance, from the spread of the two
+		# detected columns through the intersection (numerical Jacobian). At the
+		# edges, a step that leaves the map is taken the other way; the
+		# covariance is NaN when neither way stays in.
+		col_f = self._columns[Views.FRONT]
+		col_s = self._columns[Views.SIDE]
+		if col_f is None or col_s is None or self._homo_front is None or \
+			self._homo_side is None:
+			return None, None, None
+
+		p = self.intersectColumns(col_f[0], col_s[0])
+		if p is None:
+			return None, None, None
+
+		scale = np.array([self._fieldWidth / self._pixelMapSize[0],
+			-self._fieldLength / self._pixelMapSize[1]])
+		step = 0.5
+		J = np.zeros((2, 2))
+		for k, (dc_f, dc_s) in enumerate(((1.0, 0.0), (0.0, 1.0))):
+			J[:, k] = np.nan
+			for h in (step, -step):
+				q = self.intersectColumns(col_f[0] + h*dc_f, col_s[0] + h*dc_s)
+				if not q is None:
+					J[:, k] = (np.array(q) - np.array(p)) * scale / h
+					break
+		cov = J.dot(np.diag([col_f[1]**2, col_s[1]**2])).dot(J.T)
+
+		out_x = p[0] * scale[0]
+		out_y = self._fieldLength + p[1] * scale[1]
+		return out_x, out_y, cov
+
+
 	def rescaleToMetric(self, map):
 
 		box = self.getMainWhiteSegment(map)
@@ -293,13 +463,16 @@ class MovingObjectGroundTruthGeneration:
 		elif self._key == ord('s'):
 			self._ROI_front = cv.selectROI(front)
 			print('Selected ROI: ', self._ROI_front)
+			self.saveCalibration()
 
 		elif self._key == ord('d'):
 			self._ROI_side = cv.selectROI(side)
 			print('Selected ROI: ', self._ROI_side)
+			self.saveCalibration()
 
 		elif self._key == ord('f'):
 			self.calcTransforms()
+			self.saveCalibration()
 		
 		elif self._key == ord('z'):
 			self._delay = 100000000000
@@ -324,10 +497,13 @@ class MovingObjectGroundTruthGeneration:
 	def detectSingleMovingObject(self, image, view):
 
 		shape = image.shape
-		motionImg = np.zeros((shape[0],shape[1],1), dtype=np.uint8)
+		motionImg = None
+		if self._drawLines:
+			motionImg = np.zeros((shape[0],shape[1],1), dtype=np.uint8)
 		y1 = 0
 		y2 = shape[0]
 		bbox = self.getMainWhiteSegment(image)
+		self._columns[view] = None
 
 		if bbox is None:
 			return motionImg
@@ -365,8 +541,12 @@ class MovingObjectGroundTruthGeneration:
 			if flag1:
 				lvx = x - lx
 
-		cv.circle(image, (x, bbox[1]+bbox[3]), 1, (255,255,255), -1)
-		cv.line(motionImg, (x, y1), (x, y2), 255, thickness=2)
+		if not self._headless:
+			cv.circle(image, (x, bbox[1]+bbox[3]), 1, (255,255,255), -1)
+		if not motionImg is None:
+			cv.line(motionImg, (x, y1), (x, y2), 255, thickness=2)
+		# The object is anywhere across its blob width: uniform spread
+		self._columns[view] = (float(x), max(bbox[2], 1) / np.sqrt(12), y2)
 		lx = x
 
 		if view == Views.FRONT:
@@ -415,15 +595,34 @@ class MovingObjectGroundTruthGeneration:
 
 	def runVideos(self):
 
-		ret_s = True
-		ret_f = True
-		while ret_s and ret_f and self._go:
+		ret = True
+		startTime = time.time()
+		while ret and self._go:
 			self._it += 1
-			ret_f, frame_f = self._cap_front.read()
-			ret_s, frame_s = self._cap_side.read()
-			self._time += 1.0/self._fps
+			ret, frame_f, frame_s = self._videos.read()
+			if not ret:
+				break
+			# A dropped pair still takes its frame time. With the index, the time
+			# comes from the frame timestamps (the first frame still at 1/fps)
+			videoTime = self._videos.time()
+			if videoTime is None:
+				self._time = (self._videos.index + 1) * 1.0/self._fps
+			else:
+				self._time = videoTime + 1.0/self._fps
 			self.process(frame_f, frame_s)
 
+			if self._batch and self._it % 1000 == 0:
+				print("{} frame pairs, {:.1f} pairs/s".format(self._it,
+					self._it / max(time.time() - startTime, 1e-9)))
+
+		self._videos.close()
+		print("Videos:", self._videos.stats())
+		self._poseLogger.close()
+		if not self._uncertaintyLogger is None:
+			self._uncertaintyLogger.close()
+		print("{} object poses in {}".format(self._poseLogger.rowsNum,
+			self._objectPosesFileName))
+
 
 	def transformViews(self, image_f, image_s):
 
@@ -438,8 +637,23 @@ class MovingObjectGroundTruthGeneration:
 			cv.destroyWindow(self._presetUI_side)
 			self._presetUIDestroyed_side = True
 
-		out_f = cv.warpPerspective(image_f, self._homo_front, self._pixelMapSize)
-		out_s = cv.warpPerspective(image_s, self._homo_side, self._pixelMapSize)
+		maps_f = self.getMaps(Views.FRONT)['field']
+		maps_s = self.getMaps(Views.SIDE)['field']
+		out_f = cv.remap(image_f, maps_f[0], maps_f[1], cv.INTER_LINEAR)
+		out_s = cv.remap(image_s, maps_s[0], maps_s[1], cv.INTER_LINEAR)
+		return out_f, out_s
+
+
+	def transformFrames(self, frame_f, frame_s):
+
+		# Same as 'transformViews' on the cropped views, from the raw frames
+		if (self._homo_front is None) or (self._homo_side is None):
+			return None, None
+
+		maps_f = self.getMaps(Views.FRONT)['fused']
+		maps_s = self.getMaps(Views.SIDE)['fused']
+		out_f = cv.remap(frame_f, maps_f[0], maps_f[1], cv.INTER_LINEAR)
+		out_s = cv.remap(frame_s, maps_s[0], maps_s[1], cv.INTER_LINEAR)
 		return out_f, out_s
 
 
@@ -455,12 +669,67 @@ class MovingObjectGroundTruthGeneration:
 			self._dstPts)
 
 
-	def savePath(self, x, y):
+	def loadCalibration(self):
+
+		# The ROIs, field corners and homographies of this flight, saved by an
+		# earlier run, replace the ones of testData.py
+		if not os.path.exists(self._calibFileName):
+			return
+
+		with open(self._calibFileName) as f:
+			calib = yaml.safe_load(f) or {}
+
+		if not calib.get('ROI_front') is None:
+			self._ROI_front = tuple(calib['ROI_front'])
+		if not calib.get('ROI_side') is None:
+			self._ROI_side = tuple(calib['ROI_side'])
+		if calib.get('fieldCorners_front'):
+			self._fieldCorners_front = calib['fieldCorners_front']
+		if calib.get('fieldCorners_side'):
+			self._fieldCorners_side = calib['fieldCorners_side']
+
+		# The homographies only hold for the same map size
+		if tuple(calib.get('pixelMapSize', ())) == self._pixelMapSize and \
+			not calib.get('homography_front') is None and \
+			not calib.get('homography_side') is None:
+			self._homo_front = np.array(calib['homography_front'], dtype=np.float64)
+			self._homo_side = np.array(calib['homography_side'], dtype=np.float64)
+		else:
+			self.calcTransforms()
+
+		print("Field calibration loaded from " + self._calibFileName)
+
+
+	def saveCalibration(self):
+
+		def ints(v):
+			return None if v is None else [int(round(c)) for c in v]
+
+		def mat(h):
+			return None if h is None else np.asarray(h, dtype=float).tolist()
+
+		calib = {'ROI_front': ints(self._ROI_front), 'ROI_side': ints(self._ROI_side),
+			'fieldCorners_front': [ints(p) for p in self._fieldCorners_front],
+			'fieldCorners_side': [ints(p) for p in self._fieldCorners_side],
+			'pixelMapSize': list(self._pixelMapSize),
+			'homography_front': mat(self._homo_front),
+			'homography_side': mat(self._homo_side),
+			'fieldWidth': float(self._fieldWidth),
+			'fieldLength': float(self._fieldLength)}
+		with open(self._calibFileName + ".tmp", 'w') as f:
+			yaml.safe_dump(calib, f, default_flow_style=None, sort_keys=False)
+		os.replace(self._calibFileName + ".tmp", self._calibFileName)
+		print("Field calibration saved to " + self._calibFileName)
+
+
+	def savePath(self, x, y, cov=None):
 
 		if not x is None and not y is None:
 			# print(x,y,self._time)
-			df_marker = pd.DataFrame({'Xs':[x], 'Ys':[y], 'Time':[self._time]})
-			df_marker.to_csv(self._saveDir+"/objectPoses.csv", mode='a', index=False, header=False)
+			self._poseLogger.append([x, y, self._time])
+			if not cov is None:
+				self._uncertaintyLogger.append([self._time, np.sqrt(cov[0,0]),
+					np.sqrt(cov[1,1]), cov[0,1]])
 	
 
 	# def extractFileAddress(self, path):
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+import numpy as np
+import threading
+from transforms import slerp
+
+
+class OdomRingBuffer:
+
+	# Preallocated circular buffer of [x, y, z, qx, qy, qz, qw, t] rows kept in
+	# time order. Inserting is O(1) and looking a time up is O(log n). With
+	# 'size=None' the buffer never overwrites and keeps the whole flight,
+	# doubling its storage when it is full. The odometry and image callbacks
+	# run on separate threads, so inserting and looking up hold a lock.
+
+	def __init__(self, size=200, initialSize=1024):
+
+		self._size = size
+		capacity = size if not size is None else initialSize
+		self._data = np.zeros((capacity, 8))
+		self._start = 0
+		self._count = 0
+		self._lock = threading.Lock()
+		self.droppedNum = 0
+
+
+	def __len__(self):
+		return self._count
+
+
+	def append(self, row):
+
+		row = np.asarray(row).reshape(8)
+
+		with self._lock:
+			# Samples older than the newest one would break the time order
+			if self._count > 0 and row[7] <= self.time(self._count - 1):
+				self.droppedNum += 1
+				return
+
+			capacity = np.shape(self._data)[0]
+			if self._count == capacity:
+				if self._size is None:
+					self.grow()
+					capacity = np.shape(self._data)[0]
+				else:
+					self._start = (self._start + 1) % capacity
+					self._count -= 1
+
+			self._data[(self._start + self._count) % capacity, :] = row
+			self._count += 1
+
+
+	def grow(self):
+
+		self._data = np.concatenate((self.ordered(), np.zeros(np.shape(self._data))),
+			axis=0)
+		self._start = 0
+
+
+	def ordered(self):
+
+		capacity = np.shape(self._data)[0]
+		idx = (self._start + np.arange(self._count)) % capacity
+		return self._data[idx, :]
+
+
+	def row(self, k):
+		return self._data[(self._start + k) % np.shape(self._data)[0], :]
+
+
+	def time(self, k):
+		return self._data[(self._start + k) % np.shape(self._data)[0], 7]
+
+
+	def search(self, time):
+
+		# Index of the first sample not older than 'time' (like bisect_left)
+		lo = 0
+		hi = self._count
+		while lo < hi:
+			mid = (lo + hi) // 2
+			if self.time(mid) < time:
+				lo = mid + 1
+			else:
+				hi = mid
+		return lo
+
+
+	def nearest(self, time):
+
+		with self._lock:
+			if self._count == 0:
+				return None
+
+			k = self.search(time)
+			if k == self._count:
+				return self.row(k - 1).copy()
+			if k > 0 and time - self.time(k - 1) <= self.time(k) - time:
+				return self.row(k - 1).copy()
+			return self.row(k).copy()
+
+
+	def interpolate(self, time):
+
+		# Linear for the position and SLERP for the orientation. Out of the
+		# buffered time span the closest end sample is returned.
+		with self._lock:
+			if self._count == 0:
+				return None
+
+			k = self.search(time)
+			if k == 0:
+				return self.row(0).copy()
+			if k == self._count:
+				return self.row(k - 1).copy()
+
+			before = self.row(k - 1).copy()
+			after = self.row(k).copy()
+
+		ratio = (time - before[7]) / (after[7] - before[7])
+		out = np.empty(8)
+		out[:3] = before[:3] + ratio * (after[:3] - before[:3])
+		out[3:7] = slerp(before[3:7], after[3:7], ratio)
+		out[7] = time
+		return out
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+
+# Prior variances of [scale, drift (3), offset (3)] around the identity model,
+# so that the first few marker poses do not swing the drift
+PRIOR_VARIANCES = [1e-2, 1e-4, 1e-4, 1e-4, 1.0, 1.0, 1.0]
+
+
+class RecursiveDriftEstimator:
+
+	# Recursive least squares estimate of the model of
+	# dronePoseDataOptimization.py,
+	#   marker = scale * odom + drift * t + offset,
+	# updated with each marker pose at a fixed cost (7x7 matrices), instead of
+	# refitting the whole flight. With 'forgetting' below 1, older poses weigh
+	# less and the model follows a slowly changing drift. A marker position is
+	# taken to have the standard deviation 'noise' (meters) on each axis, so
+	# that P is the covariance of the parameters. Once 'minUpdates' poses are
+	# taken, a pose more than 'gate' standard deviations (Mahalanobis
+	# distance under the innovation covariance, which also grows with the
+	# drift uncertainty over time) from the prediction is rejected as an
+	# outlier; after 'maxRejections' rejections in a row the next pose is
+	# taken anyway, so that a drift grown during a stretch without markers is
+	# caught up with.
+
+	def __init__(self, forgetting=1.0, gate=None, minUpdates=5,
+		priorVariances=PRIOR_VARIANCES, maxRejections=10, noise=0.05):
+
+		self._forgetting = forgetting
+		self._noiseVariance = noise**2
+		self._gate = gate
+		self._minUpdates = minUpdates
+		self._maxRejections = maxRejections
+		self.params = np.array([1.0, 0, 0, 0, 0, 0, 0])
+		self.P = np.diag(np.asarray(priorVariances, dtype=float))
+		self.updatesNum = 0
+		self.rejectedNum = 0
+		self.readmittedNum = 0
+		self._rejectedRun = 0
+		self.lastInnovation = None
+		self.lastDistance = None
+
+
+	def design(self, t, odom):
+
+		# The (3,7) rows of the model for one pose
+		H = np.zeros((3, 7))
+		H[:, 0] = odom
+		H[:, 1:4] = t * np.eye(3)
+		H[:, 4:7] = np.eye(3)
+		return H
+
+
+	def update(self, t, odom, marker, weight=1.0):
+
+		odom = np.ravel(odom).astype(float)
+		marker = np.ravel(marker).astype(float)
+		H = self.design(t, odom)
+		innovation = marker - H.dot(self.params)
+		# The forgetting inflates the covariance carried from the earlier poses
+		P = self.P / self._forgetting
+		PHt = P.dot(H.T)
+		S = H.dot(PHt) + np.eye(3) * (self._noiseVariance / weight)
+		self.lastInnovation = float(np.linalg.norm(innovation))
+		self.lastDistance = float(np.sqrt(innovation.dot(np.linalg.solve(S, innovation))))
+
+		if not self._gate is None and self.updatesNum >= self._minUpdates and \
+			self.lastDistance > self._gate:
+			if self._maxRejections is None or self._rejectedRun < self._maxRejections:
+				self._rejectedRun += 1
+				self.rejectedNum += 1
+				return False
+			self.readmittedNum += 1
+		self._rejectedRun = 0
+
+		K = np.linalg.solve(S, PHt.T).T
+		self.params = self.params + K.dot(innovation)
+		self.P = P - K.dot(PHt.T)
+		# Keeps P symmetric against the rounding errors
+		self.P = (self.P + self.P.T) / 2
+		self.updatesNum += 1
+		return True
+
+
+	def apply(self, t, odom):
+
+		return self.design(t, np.ravel(odom).astype(float)).dot(self.params)
+
+
+	def stats(self):
+
+		return {'updates': self.updatesNum, 'rejected': self.rejectedNum,
+			'readmitted': self.readmittedNum,
+			'scale': float(self.params[0]), 'drift': self.params[1:4].tolist(),
+			'offset': self.params[4:7].tolist(),
+			'stdErrors': np.sqrt(np.diag(self.P)).tolist()}
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+import numpy as np
+import os
+import shutil
+import time
+
+
+class PoseLogger:
+
+	# Collects rows in a preallocated array and appends them to the CSV file in
+	# batches, instead of opening the file for each row. Every batch is synced
+	# to the disk, so a killed run loses at most the rows of the last batch.
+	# The CSV has no header and, like the logs written with pandas before, an
+	# extra "t<time>" text column at the end when 'timeText' is set.
+	# Optionally, each column is also appended as raw float64 values to
+	# '<name>.columns/<column>.f64' next to the CSV (see 'readColumns').
+
+	def __init__(self, fileName, columns=('Xs', 'Ys', 'Zs', 'Time'), timeText=True,
+		batchRows=50, flushPeriod=1.0, binary=False):
+
+		self._fileName = fileName
+		self._columns = list(columns)
+		self._timeIdx = self._columns.index('Time') if timeText else None
+		self._batchRows = batchRows
+		self._flushPeriod = flushPeriod
+		self._rows = np.zeros((batchRows, len(self._columns)))
+		self._n = 0
+		self._lastFlush = time.time()
+		self.rowsNum = 0
+
+		self._columnsDir = None
+		if binary:
+			self._columnsDir = columnsDir(fileName)
+			if not os.path.exists(self._columnsDir):
+				os.makedirs(self._columnsDir)
+
+
+	def append(self, values):
+
+		self._rows[self._n, :] = values
+		self._n += 1
+		self.rowsNum += 1
+
+		if self._n >= self._batchRows or \
+			time.time() - self._lastFlush >= self._flushPeriod:
+			self.flush()
+
+
+	def formatRow(self, row):
+
+		text = ",".join([repr(float(v)) for v in row])
+		if not self._timeIdx is None:
+			text += ",t" + str(float(row[self._timeIdx]))
+		return text + "\n"
+
+
+	def flush(self):
+
+		self._lastFlush = time.time()
+		if self._n == 0:
+			return
+
+		rows = self._rows[:self._n, :]
+		with open(self._fileName, 'a') as f:
+			f.write("".join([self.formatRow(row) for row in rows]))
+			f.flush()
+			os.fsync(f.fileno())
+
+		if not self._columnsDir is None:
+			for k, c in enumerate(self._columns):
+				with open(os.path.join(self._columnsDir, c + ".f64"), 'ab') as f:
+					rows[:, k].astype('<f8').tofile(f)
+					f.flush()
+					os.fsync(f.fileno())
+
+		self._n = 0
+
+
+	def close(self):
+		self.flush()
+
+
+def columnsDir(fileName):
+	return os.path.splitext(fileName)[0] + ".columns"
+
+
+def removeLog(fileName):
+
+	if os.path.exists(fileName):
+		os.remove(fileName)
+	if os.path.exists(columnsDir(fileName)):
+		shutil.rmtree(columnsDir(fileName))
+
+
+def readColumns(fileName, columns=('Xs', 'Ys', 'Zs', 'Time')):
+
+	# Reads the binary columns written next to 'fileName'. A run killed in the
+	# middle of a flush may leave columns of different lengths; they are cut
+	# to the shortest one.
+	out = {}
+	for c in columns:
+		out[c] = np.fromfile(os.path.join(columnsDir(fileName), c + ".f64"), dtype='<f8')
+	n = min([len(v) for v in out.values()])
+	return {c: v[:n] for c, v in out.items()}
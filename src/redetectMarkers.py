@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+# Re-runs the marker detection and pose estimation of telloGTGeneration.py
+# over the frames saved in <save-dir>/rawImage, with a pool of processes.
+# The detection options of telloGTGeneration.py (--aruco-dict,
+# --marker-length, --calib, --detect-scale, ...) are accepted as well.
+# <save-dir>/rawMarkerPoses.csv and <save-dir>/markerDetectionFrames are
+# rewritten in frame order, the same as a logging run would write them.
+# --detection-cache is not used here: its size accounting is per process.
+#
+# python3 redetectMarkers.py -p <save-dir> --marker-length 0.5 --workers 8
+
+import cv2 as cv
+import multiprocessing
+import os
+import time
+from pathlib import Path
+
+from telloGTGeneration import ArucoBasedDroneGroundTruthGeneration, args, \
+	DETECTION_STATS_COLUMNS
+from poseLogger import PoseLogger, removeLog
+from markerReview import clearReview
+
+import argparse
+parser = argparse.ArgumentParser()
+parser.add_argument('-p', '--path', help='The Path to the Save Directory.', dest='path')
+parser.add_argument('--workers', help='Number of worker processes (defaults to the '
+	'number of cores).', dest='workers', type=int)
+parser.add_argument('--chunk', help='Number of frames in each work unit.',
+	dest='chunk', type=int, default=64)
+redetectArgs, unknown = parser.parse_known_args()
+
+
+_agtg = None
+
+
+def initWorker(path):
+
+	global _agtg
+	# Each worker would keep its own index and size of the shared cache
+	# directory, letting it grow to 'workers' times the limit
+	args.detectionCache = 0
+	_agtg = ArucoBasedDroneGroundTruthGeneration(path, outlierRemovalMode=True)
+
+
+def processChunk(job):
+
+	# Returns (file name, time, marker pose or None, detection stats) for each
+	# frame of the chunk. Frames with a marker are written, annotated, under a
+	# temporary name to be numbered by the main process in frame order.
+	tmpDir, fileNames = job
+	# The chunks reach the workers in any order: the tracking starts afresh on
+	# each, so that the results do not depend on the scheduling
+	_agtg._detector.reset()
+	results = []
+	for fileName in fileNames:
+		name = os.path.basename(fileName)
+		t = float(os.path.splitext(name)[0])
+		img = cv.imread(fileName)
+		id, tvec, rvec = _agtg.detect(img)
+		arucoPose = _agtg.getArucoPose(id, tvec)
+		if not arucoPose is None:
+			cv.imwrite(os.path.join(tmpDir, name), img)
+		results.append((name, t, arucoPose, _agtg._detectionStats))
+	return results
+
+
+def listFrames(path):
+
+	frameDir = path + "/rawImage"
+	names = sorted(os.listdir(frameDir), key=lambda n: float(os.path.splitext(n)[0]))
+	return [os.path.join(frameDir, n) for n in names]
+
+
+def redetect(path, workers=None, chunk=64):
+
+	if args.detectionCache > 0:
+		print("The detection cache is not used by the re-detection workers")
+	fileNames = listFrames(path)
+	markerImagesDir = path + "/markerDetectionFrames"
+	tmpDir = markerImagesDir + "/.redetect"
+
+	removeLog(path + "/rawMarkerPoses.csv")
+	removeLog(path + "/markerDetectionStats.csv")
+	removeLog(path + "/markerPoseScores.csv")
+	if not os.path.exists(markerImagesDir):
+		os.mkdir(markerImagesDir)
+	for mi in Path(markerImagesDir).iterdir():
+		if mi.is_file():
+			os.remove(str(mi))
+	if not os.path.exists(tmpDir):
+		os.mkdir(tmpDir)
+	clearReview(path)
+
+	logger = PoseLogger(path + "/rawMarkerPoses.csv", batchRows=1000,
+		flushPeriod=5.0, binary=args.binaryLog)
+	statsLogger = PoseLogger(path + "/markerDetectionStats.csv",
+		columns=DETECTION_STATS_COLUMNS, timeText=False, batchRows=1000, flushPeriod=5.0)
+	jobs = [(tmpDir, fileNames[k:k+chunk]) for k in range(0, len(fileNames), chunk)]
+
+	print("----- Re-detecting markers in {} frames with {} workers -----".format(
+		len(fileNames), workers or multiprocessing.cpu_count()))
+	startTime = time.time()
+	doneNum = 0
+	markerNum = 0
+	with multiprocessing.Pool(workers, initializer=initWorker, initargs=(path,)) as pool:
+		# imap keeps the order of the chunks, whichever worker ends first
+		for results in pool.imap(processChunk, jobs):
+			for name, t, arucoPose, stats in results:
+				doneNum += 1
+				if arucoPose is None:
+					continue
+				markerNum += 1
+				logger.append(arucoPose.ravel().tolist() + [t])
+				statsLogger.append([t] + stats)
+				os.rename(os.path.join(tmpDir, name),
+					markerImagesDir + "/img{}.jpg".format(markerNum))
+
+			elapsed = time.time() - startTime
+			print("{}/{} frames, {} markers, {:.1f} frames/s".format(doneNum,
+				len(fileNames), markerNum, doneNum / max(elapsed, 1e-9)))
+
+	logger.close()
+	statsLogger.close()
+	os.rmdir(tmpDir)
+	print("----- Re-detection done -----")
+
+
+if __name__ == '__main__' :
+
+	redetect(redetectArgs.path, redetectArgs.workers, redetectArgs.chunk)
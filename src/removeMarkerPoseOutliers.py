@@ -3,8 +3,12 @@ from telloGTGeneration import ArucoBasedDroneGroundTruthGeneration
 import argparse
 parser = argparse.ArgumentParser()
 parser.add_argument('-p', '--path', help='The Path to the Bag File.', dest='path')
+parser.add_argument('-g', '--grid', help='Review the frames as pages of thumbnails.',
+	dest='grid', action='store_true')
+parser.add_argument('-s', '--scores', help='Only review the frames left for review by '
+	'scoreMarkerPoses.py.', dest='scores', action='store_true')
 args, unknown = parser.parse_known_args()
 
 abdgtg = ArucoBasedDroneGroundTruthGeneration(args.path, outlierRemovalMode=True)
 
-abdgtg.deleteOutliers()
+abdgtg.deleteOutliers(args.grid, args.scores)
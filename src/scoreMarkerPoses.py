@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+# Scores every marker pose of <save-dir>/rawMarkerPoses.csv as a likely inlier
+# or outlier, from:
+#   - the reprojection error of the marker corners,
+#   - the jump from the neighbouring detections,
+#   - the distance to the corrected odometry at the same time,
+#   - the apparent marker size against the estimated distance.
+# Each figure is turned into a robust z-score (median/MAD over the flight),
+# and the confidence of a pose is exp(-0.5 * (S / scale)^2), where S is the
+# RMS of its positive z-scores. Poses at or above '--confidence' are written
+# to cleanMarkerPoses.csv directly, the ones below '--drop-below' are dropped,
+# and only the rest are left for the manual review
+# (removeMarkerPoseOutliers.py --scores).
+#
+# python3 scoreMarkerPoses.py -p <save-dir> --confidence 0.9
+
+import numpy as np
+import pandas as pd
+import os
+
+import argparse
+parser = argparse.ArgumentParser()
+parser.add_argument('-p', '--path', help='The Path to the Save Directory.', dest='path')
+parser.add_argument('--confidence', help='Poses at or above this confidence are kept '
+	'without review.', dest='confidence', type=float, default=0.9)
+parser.add_argument('--drop-below', help='Poses below this confidence are dropped '
+	'without review.', dest='dropBelow', type=float, default=0.1)
+parser.add_argument('--scale', help='The RMS z-score at which the confidence is '
+	'exp(-0.5).', dest='scale', type=float, default=3.0)
+parser.add_argument('--odom-max-dt', help='Largest time difference (seconds) to an '
+	'odometry sample to compare with.', dest='odomMaxDt', type=float, default=0.5)
+args, unknown = parser.parse_known_args()
+
+
+def robustZ(v):
+
+	# (v - median) / (1.4826 MAD), ignoring NaNs; NaNs score 0
+	z = np.zeros(len(v))
+	ok = np.isfinite(v)
+	if np.count_nonzero(ok) < 3:
+		return z
+	med = np.median(v[ok])
+	mad = 1.4826 * np.median(np.abs(v[ok] - med))
+	if mad < 1e-12:
+		mad = max(np.std(v[ok]), 1e-12)
+	z[ok] = (v[ok] - med) / mad
+	return z
+
+
+def jumpSpeeds(p, t):
+
+	# Speed to the closer (in speed) of the two neighbouring detections; a lone
+	# wrong pose is far from both of them
+	d = np.linalg.norm(np.diff(p, axis=0), axis=1)
+	dt = np.maximum(np.diff(t), 1e-3)
+	v = d / dt
+	prev = np.concatenate(([np.inf], v))
+	next = np.concatenate((v, [np.inf]))
+	out = np.minimum(prev, next)
+	out[~np.isfinite(out)] = np.nan
+	return out
+
+
+def odomErrors(p, t, odoms, maxDt):
+
+	out = np.full(len(t), np.nan)
+	if odoms is None or len(odoms) == 0:
+		return out
+
+	order = np.argsort(odoms[:, 3])
+	odoms = odoms[order]
+	k = np.clip(np.searchsorted(odoms[:, 3], t), 1, len(odoms) - 1)
+	before = np.abs(t - odoms[k-1, 3]) <= np.abs(odoms[k, 3] - t)
+	k = np.where(before, k - 1, k)
+	near = np.abs(odoms[k, 3] - t) <= maxDt
+	out[near] = np.linalg.norm(p[near] - odoms[k[near], :3], axis=1)
+	return out
+
+
+def scoreMarkerPoses(path, confidence=0.9, dropBelow=0.1, scale=3.0, odomMaxDt=0.5):
+
+	raw = pd.read_csv(path + "/rawMarkerPoses.csv", sep=',', header=None)
+	p = raw.values[:, :3].astype(float)
+	t = raw.values[:, 3].astype(float)
+
+	features = {'Jump': jumpSpeeds(p, t)}
+
+	odoms = None
+	if os.path.exists(path + "/odomPoses.csv"):
+		odoms = pd.read_csv(path + "/odomPoses.csv", sep=',', header=None).values[:, :4]
+		odoms = odoms.astype(float)
+	features['OdomError'] = odomErrors(p, t, odoms, odomMaxDt)
+
+	statsFile = path + "/markerDetectionStats.csv"
+	if os.path.exists(statsFile):
+		stats = pd.read_csv(statsFile, sep=',', header=None).values.astype(float)
+		if len(stats) != len(t) or not np.array_equal(stats[:, 0], t):
+			raise ValueError(statsFile + " does not match rawMarkerPoses.csv")
+		features['ReprojErr'] = stats[:, 2]
+		features['SizeError'] = np.abs(np.log(np.maximum(stats[:, 5], 1e-9)))
+	else:
+		print("No " + statsFile + "; scoring without the detection figures")
+
+	# Only larger than usual figures count against a pose
+	zs = np.stack([np.maximum(robustZ(v), 0) for v in features.values()], axis=1)
+	S = np.sqrt(np.mean(zs**2, axis=1))
+	conf = np.exp(-0.5 * (S / scale)**2)
+
+	decision = np.where(conf >= confidence, 'keep',
+		np.where(conf < dropBelow, 'drop', 'review'))
+
+	scores = pd.DataFrame(dict({'Time': t}, **features))
+	scores['Score'] = S
+	scores['Confidence'] = conf
+	scores['Decision'] = decision
+	scores.to_csv(path + "/markerPoseScores.csv", index_label='Index')
+
+	raw[decision == 'keep'].to_csv(path + "/cleanMarkerPoses.csv", index=False,
+		header=False)
+
+	print("{} poses: {} kept, {} dropped, {} left for review".format(len(t),
+		np.count_nonzero(decision == 'keep'), np.count_nonzero(decision == 'drop'),
+		np.count_nonzero(decision == 'review')))
+	return scores
+
+
+if __name__ == '__main__' :
+
+	scoreMarkerPoses(args.path, args.confidence, args.dropBelow, args.scale,
+		args.odomMaxDt)
@@ -1,21 +1,115 @@
 #!/usr/bin/env python
 
-import rospy
-from sensor_msgs.msg import Image
-from nav_msgs.msg import Odometry
-from cv_bridge import CvBridge, CvBridgeError
+try:
+	import rospy
+	from sensor_msgs.msg import Image
+	from nav_msgs.msg import Odometry
+	from geometry_msgs.msg import PointStamped
+except ImportError:
+	# Offline replay of a message dump does not need ROS
+	rospy = None
 import cv2 as cv
 import numpy as np
 import pandas as pd
 import os
-import math
 from pathlib import Path
 import subprocess
 import sys
+import bagReplay
+from odomBuffer import OdomRingBuffer
+from asyncImageWriter import AsyncImageWriter
+from poseLogger import PoseLogger, removeLog
+from markerDetector import ArucoDetector
+from detectionCache import DetectionCache, paramsKey
+from markerReview import MarkerFrameReview, listMarkerFrames, clearReview, \
+	frameIndex
+from latencyProfiler import LatencyProfiler, NullProfiler
+from onlineDriftEstimator import RecursiveDriftEstimator
+import transforms
+import imageDecoding
 
 import argparse
 parser = argparse.ArgumentParser()
 parser.add_argument('-p', '--path', help='The Path to the Bag File.', dest='path')
+parser.add_argument('-b', '--bag', help='The Bag File to Replay Offline.', dest='bag')
+parser.add_argument('--offline', help='Replay the bag file (or the message dump in '
+	'<path>/messageDump when ROS is absent) as fast as possible, without windows.',
+	dest='offline', action='store_true')
+parser.add_argument('--headless', help='Do no drawing, no windows and no key polling '
+	'(implied by --offline).', dest='headless', action='store_true')
+parser.add_argument('--init-time', help='Initialize on the first marker detection '
+	'at or after this bag time (seconds), instead of the \'a\' key.',
+	dest='initTime', type=float)
+parser.add_argument('--init-marker', help='Initialize on the first detection of this '
+	'marker ID, instead of the \'a\' key.', dest='initMarker', type=int)
+parser.add_argument('--odom-history', help='Number of odometry samples buffered for '
+	'the image synchronization (0 keeps the whole flight).', dest='odomHistory',
+	type=int, default=200)
+parser.add_argument('--odom-sync', help='Take the nearest odometry sample or '
+	'interpolate the two around the image time.', dest='odomSync',
+	choices=['nearest', 'interpolate'], default='nearest')
+parser.add_argument('--writer-threads', help='Number of background image writer '
+	'threads.', dest='writerThreads', type=int, default=2)
+parser.add_argument('--writer-queue', help='Number of images the writer queue holds '
+	'before dropping new raw frames (marker frames are never dropped).',
+	dest='writerQueue', type=int, default=64)
+parser.add_argument('--writer-block', help='Wait for room in the writer queue instead '
+	'of dropping images.', dest='writerBlock', action='store_true')
+parser.add_argument('--jpeg-quality', help='JPEG quality of the saved frames.',
+	dest='jpegQuality', type=int, default=95)
+parser.add_argument('--png-compression', help='PNG compression level of the saved '
+	'frames.', dest='pngCompression', type=int, default=3)
+parser.add_argument('--log-batch', help='Number of pose rows written to the CSV logs '
+	'at once.', dest='logBatch', type=int, default=50)
+parser.add_argument('--log-period', help='Longest time (seconds) a pose row waits '
+	'before being written.', dest='logPeriod', type=float, default=1.0)
+parser.add_argument('--binary-log', help='Also write the pose logs as binary columns '
+	'next to the CSV files.', dest='binaryLog', action='store_true')
+parser.add_argument('--roi-tracking', help='Search for the markers around the last '
+	'detection before searching the whole frame.', dest='roiTracking',
+	action='store_true')
+parser.add_argument('--roi-padding', help='Padding of the tracked search region, as '
+	'a ratio of the last detection size.', dest='roiPadding', type=float, default=0.5)
+parser.add_argument('--roi-max-misses', help='Missed region searches in a row before '
+	'the whole frame is searched.', dest='roiMaxMisses', type=int, default=3)
+parser.add_argument('--roi-refresh', help='Search the whole frame at least once in '
+	'this number of frames.', dest='roiRefresh', type=int, default=30)
+parser.add_argument('--detect-scale', help='Find the markers on the image downscaled '
+	'by this factor, then refine their corners at full resolution.',
+	dest='detectScale', type=float, default=1.0)
+parser.add_argument('--aruco-dict', help='The ArUco dictionary of the markers.',
+	dest='arucoDict', default='DICT_4X4_250')
+parser.add_argument('--marker-length', help='The side length of the markers (meters).',
+	dest='markerLength', type=float, default=0.478)
+parser.add_argument('--calib', help='The camera calibration file (defaults to '
+	'params/telloCam.yaml).', dest='calib')
+parser.add_argument('--detection-cache', help='Size (MB) of the marker detection cache '
+	'kept in <path>/detectionCache for reruns on the same frames (0 disables it).',
+	dest='detectionCache', type=float, default=0)
+parser.add_argument('--profile', help='Time the callback stages and the image/odometry '
+	'sync delay, and save a summary to <path>/latencyProfile.json/.csv on shutdown.',
+	dest='profile', action='store_true')
+parser.add_argument('--profile-period', help='Print a profile line every this number '
+	'of seconds (0 disables it).', dest='profilePeriod', type=float, default=0)
+parser.add_argument('--online-drift', help='Fit the odometry drift to the marker poses '
+	'during the flight and log the drift corrected odometry to odomPoses.csv (the '
+	'single anchor correction goes to anchorOdomPoses.csv).', dest='onlineDrift',
+	action='store_true')
+parser.add_argument('--online-forgetting', help='Forgetting factor of the online drift '
+	'fit (1 weighs all the marker poses the same).', dest='onlineForgetting',
+	type=float, default=1.0)
+parser.add_argument('--online-noise', help='Standard deviation (meters) of a marker '
+	'position on each axis, for the online drift fit.', dest='onlineNoise',
+	type=float, default=0.05)
+parser.add_argument('--online-gate', help='Marker poses more than this number of '
+	'standard deviations (Mahalanobis distance, under --online-noise and the model '
+	'uncertainty) from the online drift prediction are not used (0 for no gate).',
+	dest='onlineGate', type=float, default=3.0)
+parser.add_argument('--online-max-rejections', help='Marker poses rejected in a row '
+	'by the gate before the next one is taken anyway.', dest='onlineMaxRejections',
+	type=int, default=10)
+parser.add_argument('--online-topic', help='Also publish the drift corrected odometry '
+	'as geometry_msgs/PointStamped on this topic.', dest='onlineTopic')
 args, unknown = parser.parse_known_args()
 
 rootOfRepo = subprocess.getoutput("git rev-parse --show-toplevel")
@@ -24,6 +118,9 @@ sys.path.insert(1, args.path)
 import testData
 
 
+DETECTION_STATS_COLUMNS = ('Time', 'Id', 'ReprojErr', 'SidePx', 'Dist', 'SizeRatio')
+
+
 ARUCO_DICT = {
 	"DICT_4X4_50": cv.aruco.DICT_4X4_50,
 	"DICT_4X4_100": cv.aruco.DICT_4X4_100,
@@ -50,35 +147,99 @@ class ArucoBasedDroneGroundTruthGeneration:
 	def __init__(self, saveAddress,  outlierRemovalMode=False):
 
 		calibFile = rootOfRepo + "/params/telloCam.yaml"
+		if not args.calib is None:
+			calibFile = args.calib
 
 		self._markerPosesFileName = saveAddress + "/rawMarkerPoses.csv"
 		self._newMarkerPosesFileName = saveAddress + "/cleanMarkerPoses.csv"
 		self._odomPosesFileName = saveAddress + "/odomPoses.csv"
+		self._anchorOdomPosesFileName = saveAddress + "/anchorOdomPoses.csv"
+		self._detectionStatsFileName = saveAddress + "/markerDetectionStats.csv"
+		self._profileFileName = saveAddress + "/latencyProfile"
+		self._scoresFileName = saveAddress + "/markerPoseScores.csv"
 		self._markerImagesDir = saveAddress + "/markerDetectionFrames"
+		self._saveAddress = saveAddress
 		
+		self._imageWriter = None
+		self._saveMarkerFrames = not outlierRemovalMode
+		self._markerLogger = None
+		self._odomLogger = None
+		self._statsLogger = None
+		self._anchorLogger = None
+		self._driftEstimator = None
+		self._driftPub = None
 		if not outlierRemovalMode:
 			self.removeOldLogs()
-
-		aDictName = "DICT_4X4_250"
+			self._markerLogger = PoseLogger(self._markerPosesFileName,
+				batchRows=args.logBatch, flushPeriod=args.logPeriod, binary=args.binaryLog)
+			self._odomLogger = PoseLogger(self._odomPosesFileName,
+				batchRows=args.logBatch, flushPeriod=args.logPeriod, binary=args.binaryLog)
+			self._statsLogger = PoseLogger(self._detectionStatsFileName,
+				columns=DETECTION_STATS_COLUMNS, timeText=False,
+				batchRows=args.logBatch, flushPeriod=args.logPeriod)
+			if args.onlineDrift:
+				self._anchorLogger = PoseLogger(self._anchorOdomPosesFileName,
+					batchRows=args.logBatch, flushPeriod=args.logPeriod,
+					binary=args.binaryLog)
+				self._driftEstimator = RecursiveDriftEstimator(args.onlineForgetting,
+					args.onlineGate if args.onlineGate > 0 else None,
+					maxRejections=args.onlineMaxRejections, noise=args.onlineNoise)
+				if not args.onlineTopic is None and not rospy is None and \
+					not args.offline:
+					self._driftPub = rospy.Publisher(args.onlineTopic, PointStamped,
+						queue_size=10)
+			# Offline, nothing is lost by waiting for the disk
+			self._imageWriter = AsyncImageWriter(args.writerThreads, args.writerQueue,
+				args.jpegQuality, args.pngCompression, args.writerBlock or args.offline)
+
+		aDictName = args.arucoDict
 		self._arucoDict = cv.aruco.Dictionary_get(ARUCO_DICT[aDictName])
 		self._arucoParams = cv.aruco.DetectorParameters_create()
+		detectionCache = None
+		if args.detectionCache > 0:
+			detectionCache = DetectionCache(saveAddress + "/detectionCache",
+				paramsKey(aDictName, self._arucoParams, args.detectScale,
+					args.roiTracking, args.roiPadding, args.roiMaxMisses, args.roiRefresh),
+				int(args.detectionCache * 1024 * 1024))
+		self._detector = ArucoDetector(self._arucoDict, self._arucoParams,
+			validIds=set(testData.idPoses.keys()), tracking=args.roiTracking,
+			padding=args.roiPadding, maxMisses=args.roiMaxMisses,
+			refreshPeriod=args.roiRefresh, scale=args.detectScale, cache=detectionCache)
 		fs = cv.FileStorage(calibFile, cv.FILE_STORAGE_READ)
 		self.setCameraParams(fs.getNode("camera_matrix").mat(),
 			fs.getNode("distortion_coefficients").mat())
-		self.defSub(1)
+		self._offline = args.offline
+		self._headless = args.headless or args.offline
+		# The message stamps are only comparable to the wall clock live
+		self._profiling = args.profile and not outlierRemovalMode
+		self._profiler = NullProfiler()
+		if self._profiling:
+			self._profiler = LatencyProfiler(args.profilePeriod, wallClock=not self._offline)
+		self._odomSkippedNum = 0
+		if not outlierRemovalMode and not self._offline:
+			self.defSub(1)
+		else:
+			self.defSub()
 		self._axis3D = np.float32([ [0, 0, 0],
 									[0.5, 0, 0],
 									[0, 0.5, 0],
 									[0, 0, 0.5]])
-		self._markerLength = 0.478
+		self._markerLength = args.markerLength
+		# Marker corners in the marker frame, in the order of detectMarkers
+		half = self._markerLength / 2
+		self._markerCorners3D = np.float32([[-half, half, 0], [half, half, 0],
+			[half, -half, 0], [-half, -half, 0]])
+		self._detectionStats = None
+		self._R_flip = np.diag([1.0, -1.0, -1.0])
 		self.check_dir = 0
 		self._it = 0
 		self._it_marker = 0
-		self._odomBuffer = np.zeros((1,8))
-		self._odomBufferSize = 200
+		self._odomBufferSize = args.odomHistory if args.odomHistory > 0 else None
+		self._odomBuffer = OdomRingBuffer(self._odomBufferSize)
 		self._lastX = 0
 		self._initialized = False
 		self._initOdom = None
+		self._initTime = None
 		self._beta = 18
 		self._image = None
 		# self._arucoPoses = np.zeros((1,3))
@@ -95,7 +256,60 @@ class ArucoBasedDroneGroundTruthGeneration:
 			self.odom_sub = rospy.Subscriber("/tello/odom", Odometry, self.odomCallback)
 			self.image_sub = rospy.Subscriber("/tello/camera/image_raw", Image,
 				self.imageCallback)
-			self.bridge = CvBridge()
+
+
+	def replayOffline(self, bagFile=None):
+
+		if not bagFile is None and not bagReplay.rosbag is None:
+			print("----- Replaying the bag file offline -----")
+			odoms, images = bagReplay.readBag(bagFile)
+		else:
+			print("----- Replaying the message dump offline -----")
+			odoms, images = bagReplay.readDump(args.path + "/messageDump")
+
+		odomNum, imageNum = bagReplay.replay(bagReplay.mergeStreams(odoms, images),
+			self.odomCallback, self.imageCallback)
+		print("----- Replayed {} odometry and {} image messages -----".format(
+			odomNum, imageNum))
+		self.shutdown()
+
+
+	def shutdown(self):
+
+		if not self._markerLogger is None:
+			self._markerLogger.close()
+			self._odomLogger.close()
+			self._statsLogger.close()
+		if not self._anchorLogger is None:
+			self._anchorLogger.close()
+			print("Online drift:", self._driftEstimator.stats())
+
+		if not self._imageWriter is None:
+			print("----- Flushing the image writer -----")
+			self._imageWriter.close()
+			print("Image writer:", self._imageWriter.stats())
+
+		print("Marker detector:", self._detector.stats())
+
+		if self._profiling:
+			self._profiler.setCounter("odom_unchanged_skipped", self._odomSkippedNum)
+			self._profiler.setCounter("odom_out_of_order_dropped",
+				self._odomBuffer.droppedNum)
+			if not self._imageWriter is None:
+				self._profiler.setCounter("images_write_dropped",
+					self._imageWriter.droppedNum)
+			self._profiler.report()
+			self._profiler.export(self._profileFileName + ".json",
+				self._profileFileName + ".csv")
+			print("Latency profile saved to " + self._profileFileName + ".json/.csv")
+
+
+	def writeImage(self, fileName, image, copy=True, block=None):
+
+		if self._imageWriter is None:
+			cv.imwrite(fileName, image)
+		else:
+			self._imageWriter.write(fileName, image, copy, block)
 
 
 	def removeOldLogs(self):
@@ -105,21 +319,24 @@ class ArucoBasedDroneGroundTruthGeneration:
 		if not os.path.exists(self._markerImagesDir):
 			os.mkdir(self._markerImagesDir)
 			
-		if os.path.exists(self._odomPosesFileName):
-			os.remove(self._odomPosesFileName)
-		
-		if os.path.exists(self._markerPosesFileName):
-			os.remove(self._markerPosesFileName)
+		removeLog(self._odomPosesFileName)
+		removeLog(self._anchorOdomPosesFileName)
+		removeLog(self._markerPosesFileName)
+		removeLog(self._detectionStatsFileName)
+		removeLog(self._scoresFileName)
 		
 		markerImages = Path(self._markerImagesDir).iterdir()
 		for mi in markerImages:
 			fileName = str(mi)
 			os.remove(fileName)
 
+		clearReview(self._saveAddress)
+
 
 	def odomCallback(self, data=None):
 
 		if not data is None:
+			self._profiler.begin('odom', data.header)
 			t = data.header.stamp.to_sec()
 			x = data.pose.pose.position.x
 			y = data.pose.pose.position.y
@@ -131,48 +348,46 @@ class ArucoBasedDroneGroundTruthGeneration:
 
 			if x == self._lastX:
 				# print('equal X')
+				self._odomSkippedNum += 1
+				self._profiler.end()
 				return
 
 			self._lastX = x
 			pose_orientation_t = np.array([x, y, z, qx, qy, qz, qw, t]).reshape(1,8)
 			self.bufferOdom(pose_orientation_t)
+			self._profiler.end()
 
 
-	def savePoses(self, nums_marker, nums_odom, t):
+	def savePoses(self, nums_marker, nums_odom, t, nums_anchor=None):
 
 		if not nums_marker is None:
 
-			df_marker = pd.DataFrame({'Xs':nums_marker[0], 'Ys':nums_marker[1],
-			 	'Zs':nums_marker[2], 'Time':[t], 'text_Time':["t"+str(t)]})
-			# df_marker = pd.DataFrame({'Xs':nums_marker[0][0], 'Ys':nums_marker[1][0],
-			#  	'Zs':nums_marker[2][0]})
-
-			df_marker.to_csv(self._markerPosesFileName, mode='a', index=False, header=False)
+			self._markerLogger.append(np.ravel(nums_marker).tolist() + [t])
+			self._statsLogger.append([t] + self._detectionStats)
 
 		if not nums_odom is None:
 
-			df_odom = pd.DataFrame({'Xs':nums_odom[0], 'Ys':nums_odom[1],
-				'Zs':nums_odom[2], 'Time':[t], 'text_Time':["t"+str(t)]})
+			self._odomLogger.append(np.ravel(nums_odom).tolist() + [t])
 
-			df_odom.to_csv(self._odomPosesFileName, mode='a', index=False, header=False)
+		if not nums_anchor is None:
 
+			self._anchorLogger.append(np.ravel(nums_anchor).tolist() + [t])
 
-	def bufferOdom(self, nums):
 
-		if np.shape(self._odomBuffer)[0] < self._odomBufferSize:
-			self._odomBuffer = np.append(self._odomBuffer, nums, axis=0)
-		else:
-			for k in range(self._odomBufferSize-1):
-				self._odomBuffer[k,:] = self._odomBuffer[k+1,:]
+	def bufferOdom(self, nums):
 
-			self._odomBuffer[self._odomBufferSize-1,:] = nums
+		self._odomBuffer.append(nums)
 
 
 	def imageCallback(self, data):
 
+		self._profiler.begin('image', data.header)
 		t = data.header.stamp.to_sec()
 		self._it += 1
-		image = self.bridge.imgmsg_to_cv2(data, "bgr8")
+		# 'image' is a read-only view on the message when it is already BGR
+		image = imageDecoding.imgmsgToBgr(data)
+		gray = imageDecoding.imgmsgToGray(data, image)
+		self._profiler.lap('decode')
 		
 		# Write images
 		if (self.check_dir == 0):
@@ -187,17 +402,49 @@ class ArucoBasedDroneGroundTruthGeneration:
 				os.mkdir(DIR_PATH)
 			self.check_dir = 1
 			
-		cv.imwrite(args.path+"/rawImage/{}.jpg".format(str(t)), image)
+		# The view cannot change under the writer; a converted image may be drawn on
+		self.writeImage(args.path+"/rawImage/{}.jpg".format(str(t)), image,
+			copy=image.flags.writeable)
+		self._profiler.lap('write_raw')
 		# print (type(odomQuat))
 		# print (type(odomPose))
 
-		id, tvec, rvec = self.detect(image)
+		if not self._headless:
+			image = imageDecoding.writable(image)
+		id, tvec, rvec = self.detect(image, gray)
+		self._profiler.lap('detect')
 		arucoPose = self.getArucoPose(id, tvec)
 		odomPose, odomQuat = self.findCorrespondingOdom(t)
-		if self._initialized:
+		if self._initialized and not odomPose is None:
 			correctedOdomPose = self.getCorrectedOdom(odomPose)
 		else:
 			correctedOdomPose = None
+		anchorOdomPose = None
+		if not self._driftEstimator is None and not correctedOdomPose is None:
+			anchorOdomPose = correctedOdomPose
+			correctedOdomPose = self.correctDrift(t, anchorOdomPose, arucoPose,
+				data.header)
+		self._profiler.lap('pose_lookup')
+
+		if not self._headless:
+			self.visualize(image, rvec, arucoPose, correctedOdomPose, odomPose)
+			self._key = cv.waitKey(1)
+			self._profiler.lap('draw')
+		else:
+			self._key = -1
+
+		self.savePoses(arucoPose, correctedOdomPose, t, anchorOdomPose)
+		self._profiler.lap('log')
+
+		if not self._initialized and not id is None and not odomPose is None and \
+			self.isInitRequested(t, id):
+			print('----init----')
+			self.setInitOdoms(tvec, rvec, odomPose, odomQuat)
+			self._initTime = t
+		self._profiler.end()
+
+
+	def visualize(self, image, rvec, arucoPose, correctedOdomPose, odomPose):
 
 		cv.putText(image, "Aruco rvec: "+str(rvec), (100, 25),
 			cv.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 2)
@@ -210,13 +457,37 @@ class ArucoBasedDroneGroundTruthGeneration:
 		cv.putText(image, "Original Odom Pose: "+str(odomPose), (100, 150),
 			cv.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 2)
 		cv.imshow("Image", image)
-		self._key = cv.waitKey(1)
 
-		self.savePoses(arucoPose, correctedOdomPose, t)
 
-		if self._key == ord('a') and not self._initialized and not id is None:
-			print('----init----')
-			self.setInitOdoms(tvec, rvec, odomPose, odomQuat)
+	def isInitRequested(self, t, id):
+
+		# A configured rule replaces the 'a' key; headless without any rule, the
+		# first detection of a known marker is taken
+		if not args.initTime is None and t < args.initTime:
+			return False
+		if not args.initMarker is None and int(id) != args.initMarker:
+			return False
+		if not args.initTime is None or not args.initMarker is None or self._headless:
+			return True
+		return self._key == ord('a')
+
+
+	def correctDrift(self, t, anchorOdomPose, arucoPose, header):
+
+		# Each valid marker pose updates the drift model before it is applied;
+		# the time is counted from the initialization
+		dt = t - self._initTime
+		if not arucoPose is None:
+			self._driftEstimator.update(dt, anchorOdomPose, arucoPose)
+		pose = self._driftEstimator.apply(dt, anchorOdomPose).reshape(3,1)
+
+		if not self._driftPub is None:
+			msg = PointStamped()
+			msg.header.stamp = header.stamp
+			msg.header.frame_id = "aruco"
+			msg.point.x, msg.point.y, msg.point.z = pose.ravel().tolist()
+			self._driftPub.publish(msg)
+		return pose
 
 
 	def getCorrectedOdom(self, odomPose):
@@ -224,14 +495,16 @@ class ArucoBasedDroneGroundTruthGeneration:
 		if not self._initialized:
 			return None
 
-		odomDeltaPose = odomPose.reshape(3,1) - self._initOdom
-		odomDeltaPose[1] = -odomDeltaPose[1]
-		pose = np.matmul(self._odomToMarkerDCM, -odomDeltaPose) + self._initArucoPose
-		# print(type(odomPose))
-		# print(odomPose)
-		# print(type(pose))
-		# print(pose)
-		return pose
+		return self.getCorrectedOdoms(odomPose.reshape(1,3)).reshape(3,1)
+
+
+	def getCorrectedOdoms(self, odomPoses):
+
+		# The same correction for an (N,3) array of odometry positions at once
+		odomDeltaPoses = odomPoses - self._initOdom.reshape(1,3)
+		odomDeltaPoses[:,1] = -odomDeltaPoses[:,1]
+		return np.matmul(-odomDeltaPoses, self._odomToMarkerDCM.T) + \
+			self._initArucoPose.reshape(1,3)
 
 
 	def setInitOdoms(self, cam_wrt_aruco_pose, cam_wrt_aruco_euler,
@@ -240,14 +513,8 @@ class ArucoBasedDroneGroundTruthGeneration:
 		self._initOdom = body_wrt_odom_pose.reshape(3,1).copy()
 		self._initArucoPose = cam_wrt_aruco_pose.copy()
 
-		odom_to_body_dcm = self.make_DCM_from_quat(body_wrt_odom_quat)
-
-		body_to_cam_dcm = self.make_DCM_from_eul(np.array([90-self._beta,0,90])*3.1415/180)
-
-		cam_to_aruco_dcm = self.make_DCM_from_eul(cam_wrt_aruco_euler).T
-
-		self._odomToMarkerDCM = np.matmul(cam_to_aruco_dcm, np.matmul(body_to_cam_dcm,
-			odom_to_body_dcm))
+		self._odomToMarkerDCM = transforms.odomToArucoDcm(body_wrt_odom_quat,
+			cam_wrt_aruco_euler, self._beta)
 
 		self._initialized = True
 
@@ -263,61 +530,28 @@ class ArucoBasedDroneGroundTruthGeneration:
 
 	def findCorrespondingOdom(self, time):
 
-		minDiff = 1e9
-		pose = None
-		orientation = None
-		odomT = None
-		for k in range(np.shape(self._odomBuffer)[0]):
-			diff = abs(time-self._odomBuffer[k,7])
-			if diff < minDiff:
-				minDiff = diff
-				pose = self._odomBuffer[k, :3]
-				orientation = self._odomBuffer[k, 3:7]
-				odomT = self._odomBuffer[k,7]
-		# if not odomT is None:
-		# 	print('image and odom delay:', time-odomT)
-		return pose, orientation
-
-
-	def isRotationMatrix(self, R):
-		Rt = np.transpose(R)
-		shouldBeIdentity = np.dot(Rt, R)
-		I = np.identity(3, dtype=R.dtype)
-		n = np.linalg.norm(I - shouldBeIdentity)
-		return n < 1e-6
-
-
-
-	def rotationMatrixToEulerAngles(self, R):
-
-		assert (self.isRotationMatrix(R))
-		
-		sy = math.sqrt(R[0, 0] * R[0, 0] + R[1, 0] * R[1, 0])
-		
-		singular = sy < 1e-6
-		
-		if not singular:
-			x = math.atan2(R[2, 1], R[2, 2])
-			y = math.atan2(-R[2, 0], sy)
-			z = math.atan2(R[1, 0], R[0, 0])
+		if args.odomSync == 'interpolate':
+			odom = self._odomBuffer.interpolate(time)
 		else:
-			x = math.atan2(-R[1, 2], R[1, 1])
-			y = math.atan2(-R[2, 0], sy)
-			z = 0
-			
-		return np.array([x, y, z])
-
-
+			odom = self._odomBuffer.nearest(time)
+
+		if odom is None:
+			return None, None
+		if self._profiling:
+			# With interpolation, the delay is to the closer of the two samples used
+			if args.odomSync == 'interpolate':
+				self._profiler.syncDelay(time - self._odomBuffer.nearest(time)[7])
+			else:
+				self._profiler.syncDelay(time - odom[7])
+		return odom[:3], odom[3:7]
 
-	def detect(self, img):
 
-		R_flip  = np.zeros((3,3), dtype=np.float32)
-		R_flip[0,0] = 1.0
-		R_flip[1,1] =-1.0
-		R_flip[2,2] =-1.0
+	def detect(self, img, gray=None):
 
-		(corners, ids, rejected) = cv.aruco.detectMarkers(img, self._arucoDict,
-			parameters=self._arucoParams)
+		# The markers are found on 'gray' when given; 'img' is only drawn on, and
+		# copied first if it is a read-only message view
+		(corners, ids, rejected) = self._detector.detect(img if gray is None else gray)
+		self._detectionStats = None
 
 		if ids is not None:
 			Cs = []
@@ -327,7 +561,8 @@ class ArucoBasedDroneGroundTruthGeneration:
 					Is.append(i)
 					Cs.append(corners[k])
 
-			self.drawMarkers(img, np.array(Cs), np.array(Is))
+			if not self._headless:
+				self.drawMarkers(img, np.array(Cs), np.array(Is))
 
 			if bool(Is):
 				self._it_marker += 1
@@ -336,6 +571,7 @@ class ArucoBasedDroneGroundTruthGeneration:
 
 		        #-- Unpack the output, get only the first
 				rvec, tvec = ret[0][0,0,:], ret[1][0,0,:]
+				self._detectionStats = self.getDetectionStats(Is[0], Cs[0], rvec, tvec)
 
 				#-- Draw the detected marker and put a reference frame over it
 				# cv.aruco.drawDetectedMarkers(img, Cs)
@@ -343,34 +579,85 @@ class ArucoBasedDroneGroundTruthGeneration:
 				# TODO: Uncomment this after debugging the corresponding error:
 				# cv.aruco.drawAxes(img, self._cameraMatrix, self._distortionMatrix,
 				#  	rvec, tvec, 0.5)
-				cv.drawFrameAxes(img, self._cameraMatrix, self._distortionMatrix,
+				# Kept in headless mode too: the saved frames are reviewed by the
+				# appearance of these axes
+				canvas = imageDecoding.writable(img)
+				cv.drawFrameAxes(canvas, self._cameraMatrix, self._distortionMatrix,
 				 	rvec, tvec, 0.5)
 
-				cv.imwrite(self._markerImagesDir+"/img{}.jpg".format(self._it_marker),
-					img)
+				# Never dropped: each frame stands for a logged marker pose
+				if self._saveMarkerFrames:
+					self.writeImage(self._markerImagesDir+"/img{}.jpg".format(
+						self._it_marker), canvas, copy=canvas is img, block=True)
 				#-- Obtain the rotation matrix tag->camera
-				R_ct    = np.matrix(cv.Rodrigues(rvec)[0])
+				R_ct    = cv.Rodrigues(rvec)[0]
 				R_tc    = R_ct.T
 				self._R_tc = R_tc
 
 				#-- Now get Position and attitude f the camera respect to the marker
-				pos_camera = -R_tc*np.matrix(tvec).T
+				pos_camera = -np.matmul(R_tc, tvec.reshape(3,1))
 				#-- Get the attitude of the camera respect to the frame
-				roll_camera, pitch_camera, yaw_camera = self.rotationMatrixToEulerAngles(R_flip*R_tc)
+				roll_camera, pitch_camera, yaw_camera = transforms.eulFromDcm(
+					np.matmul(self._R_flip, R_tc))
 
-				return Is[0], np.array(pos_camera), np.array([roll_camera, pitch_camera, yaw_camera])
+				return Is[0], pos_camera, np.array([roll_camera, pitch_camera, yaw_camera])
 				# return Is[0], camTvec, camRvec
 		return None, None, None
 
 
-	def deleteOutliers(self):
+	def getDetectionStats(self, id, corners, rvec, tvec):
+
+		# Quality figures of a marker pose, used to score the outliers: the RMS
+		# reprojection error of the corners, the mean side length in pixels, the
+		# distance, and the apparent size relative to the one the distance gives
+		corners = corners.reshape(4, 2)
+		projected, _ = cv.projectPoints(self._markerCorners3D, rvec, tvec,
+			self._cameraMatrix, self._distortionMatrix)
+		reprojErr = np.sqrt(np.mean(np.sum((projected.reshape(4, 2) - corners)**2,
+			axis=1)))
+		sidePx = np.mean(np.linalg.norm(corners - np.roll(corners, -1, axis=0), axis=1))
+		dist = np.linalg.norm(tvec)
+		focal = (self._cameraMatrix[0, 0] + self._cameraMatrix[1, 1]) / 2
+		sizeRatio = sidePx * dist / (focal * self._markerLength)
+		return [float(id), float(reprojErr), float(sidePx), float(dist), float(sizeRatio)]
+
+
+	def deleteOutliers(self, grid=False, useScores=False):
 
 		print("Deleting Outliers Started.")
 		df = pd.read_csv(self._markerPosesFileName, sep=',', header=None)
-		markerImages = sorted(Path(self._markerImagesDir).iterdir(), key=os.path.getmtime)
-		num = len(markerImages)
-		toBeRemoved = []
-		for k, mi in enumerate(markerImages):
+		markerImages = listMarkerFrames(self._markerImagesDir)
+
+		# img<k>.jpg is the frame of the k-th logged pose; a frame that was not
+		# saved must not shift the later ones
+		rows = [frameIndex(mi) - 1 for mi in markerImages]
+
+		# With the scores (scoreMarkerPoses.py), the 'drop' poses are removed at
+		# once and only the 'review' ones are shown
+		dropped = []
+		if useScores:
+			decision = pd.read_csv(self._scoresFileName)['Decision'].values
+			if len(decision) != len(df):
+				raise ValueError(self._scoresFileName + " does not match " +
+					self._markerPosesFileName)
+			review = [k for k, r in enumerate(rows) if decision[r] == 'review']
+			dropped = [r for r in range(len(decision)) if decision[r] == 'drop']
+			markerImages = [markerImages[k] for k in review]
+			rows = [rows[k] for k in review]
+			print("{} frames to review, {} dropped by score".format(len(rows),
+				len(dropped)))
+
+		if grid:
+			selected = MarkerFrameReview(self._saveAddress, markerImages).run()
+			if selected is None:
+				print("Review paused; run again to resume it.")
+				return
+			toBeRemoved = sorted(dropped + [rows[k] for k in selected])
+			self.writeCleanMarkerPoses(df, toBeRemoved)
+			return
+
+		toBeRemoved = list(dropped)
+		for k, mi in zip(rows, markerImages):
 			fileName = str(mi)
 			print(fileName)
 			print(os.path.isfile(fileName))
@@ -385,6 +672,11 @@ class ArucoBasedDroneGroundTruthGeneration:
 			elif key == ord('d'):
 				toBeRemoved.append(k)
 
+		self.writeCleanMarkerPoses(df, sorted(toBeRemoved))
+
+
+	def writeCleanMarkerPoses(self, df, toBeRemoved):
+
 		print(toBeRemoved)
 		df.drop(df.index[toBeRemoved], inplace=True)
 		df.to_csv(self._newMarkerPosesFileName, index=False, header=False)
@@ -429,50 +721,17 @@ class ArucoBasedDroneGroundTruthGeneration:
 		self._cameraMatrix = cameraMatrix
 		self._distortionMatrix = distortionMatrix
 
-	def make_DCM_from_quat(self, quat):
-
-		q0 = quat[3]
-		q1 = quat[0]
-		q2 = quat[1]
-		q3 = quat[2]
-
-		DCM = np.zeros((3,3))
-		DCM[0,0] = q0**2+q1**2-q2**2-q3**2
-		DCM[0,1] = 2*(q1*q2+q0*q3)
-		DCM[0,2] = 2*(q1*q3-q0*q2)
-		DCM[1,0] = 2*(q1*q2-q0*q3)
-		DCM[1,1] = q0**2-q1**2+q2**2-q3**2
-		DCM[1,2] = 2*(q2*q3+q0*q1)
-		DCM[2,0] = 2*(q1*q3+q0*q2)
-		DCM[2,1] = 2*(q2*q3-q0*q1)
-		DCM[2,2] = q0**2-q1**2-q2**2+q3**2
-
-		return DCM
-
-	def make_DCM_from_eul(self, eul):
-
-		phi = eul[0]
-		theta = eul[1]
-		psi = eul[2]
-
-		DCM = np.zeros((3,3))
-		DCM[0,0] = np.cos(psi)*np.cos(theta)
-		DCM[0,1] = np.sin(psi)*np.cos(theta)
-		DCM[0,2] = -np.sin(theta)
-		DCM[1,0] = np.cos(psi)*np.sin(theta)*np.sin(phi)-np.sin(psi)*np.cos(phi)
-		DCM[1,1] = np.sin(psi)*np.sin(theta)*np.sin(phi)+np.cos(psi)*np.cos(phi)
-		DCM[1,2] = np.cos(theta)*np.sin(phi)
-		DCM[2,0] = np.cos(psi)*np.sin(theta)*np.cos(phi)+np.sin(psi)*np.sin(phi)
-		DCM[2,1] = np.sin(psi)*np.sin(theta)*np.cos(phi)-np.cos(psi)*np.sin(phi)
-		DCM[2,2] = np.cos(theta)*np.cos(phi)
-
-		return DCM
-
 
 if __name__ == '__main__' :
 
-	rospy.init_node('telloGTGeneration', anonymous=True)
+	if args.offline:
+		agtg = ArucoBasedDroneGroundTruthGeneration(args.path)
+		agtg.replayOffline(args.bag)
+
+	else:
+		rospy.init_node('telloGTGeneration', anonymous=True)
 
-	agtg = ArucoBasedDroneGroundTruthGeneration(args.path)
+		agtg = ArucoBasedDroneGroundTruthGeneration(args.path)
+		rospy.on_shutdown(agtg.shutdown)
 
-	rospy.spin()
+		rospy.spin()
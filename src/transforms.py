@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+# Batched rotation helpers. Every function takes arrays of any leading shape
+# (a single pose or N poses) and returns the matching leading shape, so a
+# whole flight is converted in one call. Quaternions are (x, y, z, w) like the
+# ROS odometry messages, and the DCMs follow the conventions of the former
+# 'make_DCM_from_quat' and 'make_DCM_from_eul' of telloGTGeneration.py.
+
+import numpy as np
+
+
+def dcmFromQuat(quat):
+
+	quat = np.asarray(quat, dtype=np.float64)
+	q1 = quat[..., 0]
+	q2 = quat[..., 1]
+	q3 = quat[..., 2]
+	q0 = quat[..., 3]
+
+	DCM = np.empty(quat.shape[:-1] + (3, 3))
+	DCM[..., 0, 0] = q0**2+q1**2-q2**2-q3**2
+	DCM[..., 0, 1] = 2*(q1*q2+q0*q3)
+	DCM[..., 0, 2] = 2*(q1*q3-q0*q2)
+	DCM[..., 1, 0] = 2*(q1*q2-q0*q3)
+	DCM[..., 1, 1] = q0**2-q1**2+q2**2-q3**2
+	DCM[..., 1, 2] = 2*(q2*q3+q0*q1)
+	DCM[..., 2, 0] = 2*(q1*q3+q0*q2)
+	DCM[..., 2, 1] = 2*(q2*q3-q0*q1)
+	DCM[..., 2, 2] = q0**2-q1**2-q2**2+q3**2
+	return DCM
+
+
+def dcmFromEul(eul):
+
+	eul = np.asarray(eul, dtype=np.float64)
+	sphi, cphi = np.sin(eul[..., 0]), np.cos(eul[..., 0])
+	stheta, ctheta = np.sin(eul[..., 1]), np.cos(eul[..., 1])
+	spsi, cpsi = np.sin(eul[..., 2]), np.cos(eul[..., 2])
+
+	DCM = np.empty(eul.shape[:-1] + (3, 3))
+	DCM[..., 0, 0] = cpsi*ctheta
+	DCM[..., 0, 1] = spsi*ctheta
+	DCM[..., 0, 2] = -stheta
+	DCM[..., 1, 0] = cpsi*stheta*sphi-spsi*cphi
+	DCM[..., 1, 1] = spsi*stheta*sphi+cpsi*cphi
+	DCM[..., 1, 2] = ctheta*sphi
+	DCM[..., 2, 0] = cpsi*stheta*cphi+spsi*sphi
+	DCM[..., 2, 1] = spsi*stheta*cphi-cpsi*sphi
+	DCM[..., 2, 2] = ctheta*cphi
+	return DCM
+
+
+def dcmFromRotvec(rotvec):
+
+	# Same as cv.Rodrigues, for many rotation vectors at once
+	rotvec = np.asarray(rotvec, dtype=np.float64)
+	theta = np.linalg.norm(rotvec, axis=-1)
+	small = theta < 1e-12
+	axis = rotvec / np.where(small, 1.0, theta)[..., np.newaxis]
+
+	K = np.zeros(rotvec.shape[:-1] + (3, 3))
+	K[..., 0, 1] = -axis[..., 2]
+	K[..., 0, 2] = axis[..., 1]
+	K[..., 1, 0] = axis[..., 2]
+	K[..., 1, 2] = -axis[..., 0]
+	K[..., 2, 0] = -axis[..., 1]
+	K[..., 2, 1] = axis[..., 0]
+
+	s = np.sin(theta)[..., np.newaxis, np.newaxis]
+	c = np.cos(theta)[..., np.newaxis, np.newaxis]
+	return np.eye(3) + s * K + (1 - c) * np.matmul(K, K)
+
+
+def eulFromDcm(R):
+
+	# Batched form of the former 'rotationMatrixToEulerAngles'
+	R = np.asarray(R, dtype=np.float64)
+	sy = np.sqrt(R[..., 0, 0]**2 + R[..., 1, 0]**2)
+	singular = sy < 1e-6
+
+	x = np.where(singular, np.arctan2(-R[..., 1, 2], R[..., 1, 1]),
+		np.arctan2(R[..., 2, 1], R[..., 2, 2]))
+	y = np.arctan2(-R[..., 2, 0], sy)
+	z = np.where(singular, 0.0, np.arctan2(R[..., 1, 0], R[..., 0, 0]))
+	return np.stack((x, y, z), axis=-1)
+
+
+def isRotationMatrix(R, tol=1e-6):
+
+	R = np.asarray(R)
+	shouldBeIdentity = np.matmul(np.swapaxes(R, -1, -2), R)
+	return np.linalg.norm(shouldBeIdentity - np.eye(3), axis=(-2, -1)) < tol
+
+
+def transpose(R):
+	return np.swapaxes(R, -1, -2)
+
+
+def chain(*dcms):
+
+	# chain(A, B, C) = A B C, broadcast over the leading axes, so that a single
+	# fixed DCM can be chained with N per-sample ones
+	out = dcms[0]
+	for dcm in dcms[1:]:
+		out = np.matmul(out, dcm)
+	return out
+
+
+def slerp(q0, q1, ratio):
+
+	# Spherical linear interpolation of unit quaternions, taking the shorter arc
+	q0 = np.asarray(q0, dtype=np.float64)
+	q1 = np.asarray(q1, dtype=np.float64)
+	q0 = q0 / np.linalg.norm(q0, axis=-1, keepdims=True)
+	q1 = q1 / np.linalg.norm(q1, axis=-1, keepdims=True)
+	ratio = np.asarray(ratio, dtype=np.float64)[..., np.newaxis]
+
+	dot = np.sum(q0 * q1, axis=-1, keepdims=True)
+	q1 = np.where(dot < 0, -q1, q1)
+	dot = np.abs(dot)
+
+	# Nearly parallel quaternions are linearly interpolated
+	linear = dot > 0.9995
+	theta = np.arccos(np.clip(dot, -1.0, 1.0))
+	sinTheta = np.where(linear, 1.0, np.sin(theta))
+	w0 = np.where(linear, 1 - ratio, np.sin((1 - ratio) * theta) / sinTheta)
+	w1 = np.where(linear, ratio, np.sin(ratio * theta) / sinTheta)
+	q = w0 * q0 + w1 * q1
+	return q / np.linalg.norm(q, axis=-1, keepdims=True)
+
+
+def bodyToCamDcm(beta):
+
+	# The camera of the tello is pitched down by 'beta' degrees
+	return dcmFromEul(np.array([90-beta, 0, 90])*3.1415/180)
+
+
+def odomToArucoDcm(body_wrt_odom_quat, cam_wrt_aruco_euler, beta):
+
+	# The odom -> body -> cam -> aruco chain of 'setInitOdoms'
+	return chain(transpose(dcmFromEul(cam_wrt_aruco_euler)), bodyToCamDcm(beta),
+		dcmFromQuat(body_wrt_odom_quat))
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+
+import cv2 as cv
+import numpy as np
+import os
+import shutil
+import subprocess
+
+
+# Bumped when the cached index format changes
+INDEX_VERSION = 2
+
+
+def cacheFileName(videoFile):
+
+	return videoFile + ".index.npz"
+
+
+def ffprobe(videoFile, entries):
+
+	# The csv lines of ffprobe for the first video stream, or None
+	try:
+		out = subprocess.run(["ffprobe", "-v", "error", "-select_streams", "v:0",
+			"-show_entries", entries, "-of", "csv=p=0", videoFile],
+			stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout
+	except (OSError, subprocess.CalledProcessError):
+		return None
+	return [line.strip().split(",") for line in out.decode().splitlines()]
+
+
+def probe(videoFile):
+
+	# Frame timestamps (presentation order) and keyframe numbers from the
+	# packets listed by ffprobe, without decoding; None if ffprobe is missing
+	# or fails
+	if shutil.which("ffprobe") is None:
+		return None
+
+	packets = ffprobe(videoFile, "packet=pts_time,flags")
+	if packets is None:
+		return None
+
+	pts = []
+	isKey = []
+	for fields in packets:
+		if len(fields) < 2 or fields[0] in ("", "N/A"):
+			continue
+		# Discarded packets (edit lists) are not output as frames
+		if "D" in fields[1]:
+			continue
+		pts.append(float(fields[0]))
+		isKey.append("K" in fields[1])
+	if not pts:
+		return None
+
+	# OpenCV reports the positions relative to the stream start time
+	startTime = None
+	stream = ffprobe(videoFile, "stream=start_time")
+	if stream and stream[0] and not stream[0][0] in ("", "N/A"):
+		startTime = float(stream[0][0])
+	if startTime is None:
+		startTime = min(pts)
+
+	# The packets come in decoding order; the frames are numbered in
+	# presentation order
+	pts = np.array(pts) - startTime
+	order = np.argsort(pts, kind='stable')
+	rank = np.empty(len(pts), dtype=np.int64)
+	rank[order] = np.arange(len(pts))
+	keyframes = np.sort(rank[np.array(isKey)])
+	return pts[order], keyframes
+
+
+def scan(videoFile):
+
+	# Without ffprobe: one pass of OpenCV over the whole video, reading the
+	# timestamp of each frame. The keyframes stay unknown.
+	cap = cv.VideoCapture(videoFile)
+	timestamps = []
+	while cap.grab():
+		timestamps.append(cap.get(cv.CAP_PROP_POS_MSEC) / 1000.0)
+	cap.release()
+	return np.array(timestamps), np.zeros(0, dtype=np.int64)
+
+
+class VideoIndex:
+
+	# Per-video table of the frame timestamps and keyframes, built once and
+	# cached next to the video ('<video>.index.npz'); the cache is rebuilt
+	# when the video size or mtime changes. It allows exact seeks to a frame
+	# number (from the closest keyframe before it, checked by the timestamp
+	# of the landing frame) and frame-accurate timestamps.
+
+	def __init__(self, videoFile):
+
+		self._videoFile = videoFile
+		st = os.stat(videoFile)
+		self._stamp = np.array([INDEX_VERSION, st.st_size, st.st_mtime])
+
+		if not self.load():
+			print("Indexing " + videoFile + " (once) ...")
+			result = probe(videoFile)
+			if result is None:
+				result = scan(videoFile)
+			self.timestamps, self.keyframes = result
+			self.save()
+
+		intervals = np.diff(self.timestamps)
+		self.frameInterval = float(np.median(intervals)) if len(intervals) else 1/30.0
+
+
+	def load(self):
+
+		fileName = cacheFileName(self._videoFile)
+		if not os.path.exists(fileName):
+			return False
+		try:
+			cache = np.load(fileName)
+			if not np.array_equal(cache['stamp'], self._stamp):
+				return False
+			self.timestamps = cache['timestamps']
+			self.keyframes = cache['keyframes']
+		except (OSError, KeyError, ValueError):
+			return False
+		return True
+
+
+	def save(self):
+
+		# A read-only video directory only costs the indexing on each run
+		try:
+			with open(cacheFileName(self._videoFile), 'wb') as f:
+				np.savez(f, stamp=self._stamp, timestamps=self.timestamps,
+					keyframes=self.keyframes)
+		except OSError:
+			print("Could not cache the index of " + self._videoFile)
+
+
+	def __len__(self):
+		return len(self.timestamps)
+
+
+	def time(self, frame):
+
+		# Timestamp (seconds) of a frame number, extrapolated past the ends
+		if 0 <= frame < len(self.timestamps):
+			return float(self.timestamps[frame])
+		if frame < 0 or len(self.timestamps) == 0:
+			return frame * self.frameInterval
+		return float(self.timestamps[-1]) + (frame - len(self.timestamps) + 1) * \
+			self.frameInterval
+
+
+	def frameAt(self, time):
+
+		# The frame number of a timestamp, or None if no frame is that close
+		k = int(np.clip(np.searchsorted(self.timestamps, time), 0,
+			len(self.timestamps) - 1))
+		if k > 0 and time - self.timestamps[k-1] < self.timestamps[k] - time:
+			k -= 1
+		if abs(self.timestamps[k] - time) > self.frameInterval / 2:
+			return None
+		return k
+
+
+	def seekPoints(self, frame):
+
+		# Where to seek to, latest first: the keyframes before the frame, or
+		# when they are unknown, points further and further back
+		if len(self.keyframes):
+			points = list(self.keyframes[self.keyframes <= frame][::-1])
+		else:
+			points = [frame - d for d in (0, 64, 256, 1024, 4096) if frame - d > 0]
+		return [int(p) for p in points] + [0]
+
+
+	def seek(self, cap, frame):
+
+		# Positions 'cap' on 'frame' and returns (ret, image) of that frame;
+		# the next cap.read() gives the frame after it
+		for point in self.seekPoints(frame):
+			cap.set(cv.CAP_PROP_POS_FRAMES, point)
+			if not cap.grab():
+				continue
+			# After a grab, the position is the timestamp of the grabbed frame
+			current = self.frameAt(cap.get(cv.CAP_PROP_POS_MSEC) / 1000.0)
+			if current is None or current > frame:
+				continue
+			while current < frame and cap.grab():
+				current += 1
+			if current == frame:
+				return cap.retrieve()
+		return False, None
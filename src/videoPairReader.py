@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+
+import cv2 as cv
+import queue
+import threading
+
+from videoIndex import VideoIndex
+
+
+class VideoStreamReader:
+
+	# Decodes one video on its own thread into a bounded queue of
+	# (frame index, frame) items, ahead of the consumer. A frame that fails to
+	# decode before the end of the video is skipped (counted in 'droppedNum');
+	# 'maxFailures' failures in a row are taken as the end of the stream.
+	# With a VideoIndex, the initial frame is reached by an exact keyframe seek.
+
+	def __init__(self, fileName, initFrame=0, queueSize=8, maxFailures=10,
+		index=None):
+
+		self._fileName = fileName
+		self._initFrame = initFrame
+		self._index = index
+		self._queue = queue.Queue(maxsize=queueSize)
+		self._maxFailures = maxFailures
+		self._stop = threading.Event()
+		self.decodedNum = 0
+		self.droppedNum = 0
+
+		self._thread = threading.Thread(target=self.work, name="videoReader")
+		self._thread.daemon = True
+		self._thread.start()
+
+
+	def open(self):
+
+		# The capture, and the initial frame if the seek already decoded it
+		cap = cv.VideoCapture(self._fileName)
+		if self._index is None:
+			cap.set(1, self._initFrame)
+			return cap, None
+		ret, frame = self._index.seek(cap, self._initFrame)
+		if ret:
+			return cap, frame
+		# The frame numbers would not match the frames otherwise
+		print("Warning: no exact seek to frame {} of {}, falling back to "
+			"cap.set".format(self._initFrame, self._fileName))
+		cap.set(cv.CAP_PROP_POS_FRAMES, self._initFrame)
+		return cap, None
+
+
+	def work(self):
+
+		cap, first = self.open()
+		framesNum = cap.get(cv.CAP_PROP_FRAME_COUNT)
+		index = self._initFrame
+		failures = 0
+		while not self._stop.is_set():
+			if first is None:
+				ret, frame = cap.read()
+			else:
+				ret, frame = True, first
+				first = None
+			if not ret:
+				failures += 1
+				# Past the last frame, or too many broken frames in a row
+				if failures >= self._maxFailures or framesNum <= 0 or \
+					cap.get(cv.CAP_PROP_POS_FRAMES) >= framesNum:
+					break
+				self.droppedNum += 1
+				index += 1
+				continue
+
+			failures = 0
+			self.decodedNum += 1
+			if not self.put((index, frame)):
+				break
+			index += 1
+
+		cap.release()
+		self.put(None)
+
+
+	def put(self, item):
+
+		# Waits for room, unless the reader is closed meanwhile
+		while not self._stop.is_set():
+			try:
+				self._queue.put(item, timeout=0.1)
+				return True
+			except queue.Full:
+				pass
+		return False
+
+
+	def get(self):
+
+		# The next (index, frame), or None at the end of the stream
+		return self._queue.get()
+
+
+	def close(self):
+
+		self._stop.set()
+		self._thread.join()
+
+
+class VideoPairReader:
+
+	# Reads two videos in step, each decoded on its own thread. The pairs are
+	# matched by the frame index relative to each video's first frame, so a
+	# frame dropped from one video drops the other video's frame of the same
+	# index too ('droppedPairsNum'), and the two stay synchronized. With
+	# 'indexed', each video gets a cached VideoIndex (videoIndex.py) for exact
+	# seeks and the timestamps of time().
+
+	def __init__(self, front, side, initFrame_f=0, initFrame_s=0, queueSize=8,
+		indexed=True):
+
+		self._initFrame_f = initFrame_f
+		self._initFrame_s = initFrame_s
+		self.index_f = VideoIndex(front) if indexed else None
+		self.index_s = VideoIndex(side) if indexed else None
+		self._front = VideoStreamReader(front, initFrame_f, queueSize, index=self.index_f)
+		self._side = VideoStreamReader(side, initFrame_s, queueSize, index=self.index_s)
+		self._ended = False
+		self.pairsNum = 0
+		self.droppedPairsNum = 0
+		self.index = -1
+
+
+	def read(self):
+
+		# Like cv.VideoCapture.read: (ret, frame_f, frame_s); 'index' is then
+		# the synchronized frame number (from 0)
+		if self._ended:
+			return False, None, None
+
+		item_f = self._front.get()
+		item_s = self._side.get()
+		while not item_f is None and not item_s is None:
+			k_f = item_f[0] - self._initFrame_f
+			k_s = item_s[0] - self._initFrame_s
+			if k_f == k_s:
+				self.pairsNum += 1
+				self.index = k_f
+				return True, item_f[1], item_s[1]
+
+			self.droppedPairsNum += 1
+			if k_f < k_s:
+				item_f = self._front.get()
+			else:
+				item_s = self._side.get()
+
+		self._ended = True
+		return False, None, None
+
+
+	def time(self):
+
+		# Seconds from the first front frame to the current one, from the
+		# frame timestamps of the video; None without the index
+		if self.index_f is None:
+			return None
+		return self.index_f.time(self._initFrame_f + self.index) - \
+			self.index_f.time(self._initFrame_f)
+
+
+	def stats(self):
+
+		return {'pairs': self.pairsNum, 'droppedPairs': self.droppedPairsNum,
+			'decodedFront': self._front.decodedNum, 'decodedSide': self._side.decodedNum,
+			'droppedFront': self._front.droppedNum, 'droppedSide': self._side.droppedNum}
+
+
+	def close(self):
+
+		self._front.close()
+		self._side.close()
@@ -1,26 +1,24 @@
 import cv2 as cv
+from videoPairReader import VideoPairReader
 
 def writeDoubleVideoFrames(front, side, write = False, initFrame_f = 0, initFrame_s = 0):
 
     print("This function writes two input videos frame by frame \n press q to stop")
 
-    _cap_front = cv.VideoCapture(front)
-    _cap_side = cv.VideoCapture(side)
-    _cap_front.set(1,initFrame_f)
-    _cap_side.set(1,initFrame_s)
+    videos = VideoPairReader(front, side, initFrame_f, initFrame_s)
 
-    ret_f = True
-    ret_s = True
     fr = 0
-    while ret_f and ret_s:
+    while True:
+
+        ret, frame_f, frame_s = videos.read()
+        if not ret:
+            break
 
-        ret_f, frame_f = _cap_front.read()
-        ret_s, frame_s = _cap_side.read()
-        
         frame_f = cv.resize(frame_f, (800, 550))
         frame_s = cv.resize(frame_s, (800, 550))
-        
-        fr += 1
+
+        # Numbered by the synchronized index, which skips any dropped pair
+        fr = videos.index + 1
         
         cv.putText(frame_f, "Frame num: "+str(initFrame_f + fr), (100, 25),
             cv.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 255), 2)
@@ -41,3 +39,5 @@ def writeDoubleVideoFrames(front, side, write = False, initFrame_f = 0, initFram
 
         if cv.waitKey(1) == ord('q'):
             break
+
+    videos.close()